@@ -0,0 +1,145 @@
+"""
+End-to-end latency and throughput of the example gadgets on simulated hardware.
+
+Loads the fan, neck_cooler, haptics and led examples with METAGADGET_HARDWARE=sim, sends callExternal
+requests through a local HTTP server (or straight into the WSGI app with --mode wsgi) and reports, per
+gadget, request latency, throughput and how long after the request was sent the last hardware
+operation finished. Runs anywhere; no Raspberry Pi, GPIO or audio device needed.
+
+    python examples/bench/gadget_e2e.py [--requests 500] [--mode http|wsgi] [--timing-scale 1.0]
+"""
+import argparse
+import http.client
+import importlib.util
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("VERIFY_TOKEN", "bench")
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from metagadget import hardware  # noqa: E402
+
+EXAMPLES = os.path.join(ROOT, "examples")
+
+# (モジュールのパス, create_app の引数, 送るリクエスト)
+GADGETS = {
+    "fan": ("fan/fan.py", {}, ["50 30", "0 100"]),
+    "neck_cooler": ("neck_cooler/neck_cooler.py", {}, ["40 -30", "0 0"]),
+    "haptics": ("haptics/haptics.py", {"audio_dir": os.path.join(EXAMPLES, "haptics", "data"), "play_seconds": 0},
+                ["1 50", "2 80"]),
+    "led": ("led/main.py", {}, ["on", "off"]),
+}
+
+
+def load_gadget(name):
+    path, kwargs, requests = GADGETS[name]
+    spec = importlib.util.spec_from_file_location(f"gadget_{name}", os.path.join(EXAMPLES, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    app, cleanup = module.create_app(**kwargs)
+    return app, cleanup, requests
+
+
+def http_sender(app):
+    server = make_server("127.0.0.1", 0, app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+
+    def send(body):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        conn.request("POST", "/", body, {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        return response.status, data
+
+    return send, server.shutdown
+
+
+def wsgi_sender(app):
+    def start_response(status, headers):
+        start_response.status = int(status.split()[0])
+
+    def send(body):
+        environ = {
+            "REQUEST_METHOD": "POST", "PATH_INFO": "/", "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)), "wsgi.input": io.BytesIO(body),
+        }
+        data = b"".join(app.wsgi_app(environ, start_response))
+        return start_response.status, data
+
+    return send, lambda: None
+
+
+def percentile(values, q):
+    return values[min(int(len(values) * q), len(values) - 1)] * 1000 if values else None
+
+
+def bench(name, requests, mode):
+    sim = hardware.sim()
+    app, cleanup, payloads = load_gadget(name)
+    send, stop = http_sender(app) if mode == "http" else wsgi_sender(app)
+    bodies = [json.dumps({"request": p}).encode() for p in payloads]
+    try:
+        for body in bodies:
+            send(body)
+        sim.clear()
+        latencies = []
+        actuations = []
+        ops = 0
+        started = time.perf_counter()
+        for i in range(requests):
+            t = time.perf_counter()
+            status, _ = send(bodies[i % len(bodies)])
+            latencies.append(time.perf_counter() - t)
+            assert status == 200, f"{name}: HTTP {status}"
+            done = sim.operations()
+            if done:
+                # 最後のハードウェア操作が終わるまでの時間
+                actuations.append(done[-1].time - t)
+                ops += len(done)
+            sim.clear()
+        elapsed = time.perf_counter() - started
+    finally:
+        stop()
+        cleanup()
+    latencies.sort()
+    actuations.sort()
+    return {
+        "requests": requests,
+        "throughput": requests / elapsed,
+        "latencyP50Ms": percentile(latencies, 0.5),
+        "latencyP99Ms": percentile(latencies, 0.99),
+        "actuationP50Ms": percentile(actuations, 0.5),
+        "actuationP99Ms": percentile(actuations, 0.99),
+        "hardwareOpsPerRequest": ops / requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--mode", choices=("http", "wsgi"), default="http")
+    parser.add_argument("--timing-scale", type=float, default=1.0, help="multiply the simulated per-call costs")
+    parser.add_argument("gadgets", nargs="*", default=list(GADGETS))
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    hardware.use(hardware.SIM, hardware.TimingModel(scale=args.timing_scale))
+    print(f"{'gadget':<12} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'act p50':>8} {'act p99':>8} {'ops/req':>8}")
+    for name in args.gadgets:
+        r = bench(name, args.requests, args.mode)
+        print(f"{name:<12} {r['throughput']:>8.0f} {r['latencyP50Ms']:>8.2f} {r['latencyP99Ms']:>8.2f} "
+              f"{r['actuationP50Ms']:>8.2f} {r['actuationP99Ms']:>8.2f} {r['hardwareOpsPerRequest']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
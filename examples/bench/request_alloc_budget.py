@@ -0,0 +1,178 @@
+"""
+Allocation budget for one callExternal request through MetaGadget.wsgi_app.
+
+Calls the WSGI app in-process (no sockets) with an echo handler and checks:
+  - peak traced bytes per request (tracemalloc)
+  - gen0 garbage collections per 1000 requests (gc callbacks), i.e. container allocation churn
+  - blocks still allocated after the run (leaks)
+and reports RSS after --leak-requests requests. Exits with status 1 when a budget is exceeded.
+
+    VERIFY_TOKEN=x python examples/bench/request_alloc_budget.py
+    VERIFY_TOKEN=x python examples/bench/request_alloc_budget.py --compare  # also measure the werkzeug path
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("VERIFY_TOKEN", "bench")
+
+from metagadget import MetaGadget  # noqa: E402
+
+BODY = json.dumps({"request": json.dumps({"functionName": "botPress", "args": ["ABCDEF123456"]})}).encode()
+BASE_ENVIRON = {
+    "REQUEST_METHOD": "POST",
+    "PATH_INFO": "/",
+    "SERVER_NAME": "localhost",
+    "SERVER_PORT": "5001",
+    "SERVER_PROTOCOL": "HTTP/1.1",
+    "CONTENT_TYPE": "application/json",
+    "CONTENT_LENGTH": str(len(BODY)),
+    "wsgi.url_scheme": "http",
+    "wsgi.errors": sys.stderr,
+    "wsgi.multithread": False,
+    "wsgi.multiprocess": False,
+    "wsgi.run_once": False,
+}
+
+
+class WerkzeugPathGadget(MetaGadget):
+    # dispatch_request を上書きすると werkzeug の Request/Response を使う経路になる
+    def dispatch_request(self, request):
+        return super().dispatch_request(request)
+
+
+def make_app(cls):
+    app = cls()
+    app.receive(lambda command: command)
+    return app
+
+
+def start_response(status, headers):
+    pass
+
+
+def call(app):
+    environ = dict(BASE_ENVIRON)
+    environ["wsgi.input"] = io.BytesIO(BODY)
+    for chunk in app.wsgi_app(environ, start_response):
+        pass
+
+
+def harness_only(app):
+    # 呼び出し側で作る environ の分を差し引くための基準
+    environ = dict(BASE_ENVIRON)
+    environ["wsgi.input"] = io.BytesIO(BODY)
+
+
+def peak_bytes(app, func, requests):
+    tracemalloc.start()
+    func(app)
+    peaks = []
+    for _ in range(requests):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func(app)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    peaks.sort()
+    return peaks[len(peaks) // 2]
+
+
+def gen0_collections(app, func, requests):
+    collections = [0]
+
+    def on_gc(phase, info):
+        if phase == "start" and info["generation"] == 0:
+            collections[0] += 1
+
+    gc.collect()
+    gc.callbacks.append(on_gc)
+    try:
+        for _ in range(requests):
+            func(app)
+    finally:
+        gc.callbacks.remove(on_gc)
+    return collections[0] * 1000 / requests
+
+
+def leaked_blocks(app, requests):
+    for _ in range(1000):
+        call(app)
+    gc.collect()
+    before = sys.getallocatedblocks()
+    for _ in range(requests):
+        call(app)
+    gc.collect()
+    return sys.getallocatedblocks() - before
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def measure(app, args):
+    result = {
+        "peakBytes": peak_bytes(app, call, args.requests) - peak_bytes(app, harness_only, args.requests),
+        "gen0Per1k": gen0_collections(app, call, args.requests) - gen0_collections(app, harness_only, args.requests),
+        "leakedBlocks": leaked_blocks(app, args.requests),
+    }
+    rss_before = rss_mb()
+    t = time.perf_counter()
+    for _ in range(args.leak_requests):
+        call(app)
+    result["usPerRequest"] = (time.perf_counter() - t) / args.leak_requests * 1e6
+    result["rssMb"] = rss_mb()
+    result["rssGrowthMb"] = result["rssMb"] - rss_before
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000, help="requests per allocation measurement")
+    parser.add_argument("--leak-requests", type=int, default=100000, help="requests before reporting RSS")
+    parser.add_argument("--max-bytes", type=int, default=2048, help="budget: peak bytes per request")
+    parser.add_argument("--max-gen0", type=float, default=2.0, help="budget: gen0 collections per 1000 requests")
+    parser.add_argument("--max-leaked-blocks", type=int, default=64, help="budget: blocks left after the run")
+    parser.add_argument("--max-rss-growth", type=float, default=2.0, help="budget: RSS growth in MB")
+    parser.add_argument("--compare", action="store_true", help="also measure the werkzeug Request/Response path")
+    args = parser.parse_args()
+
+    result = measure(make_app(MetaGadget), args)
+    print(json.dumps(result, indent=2))
+    if args.compare:
+        print("werkzeug path:")
+        print(json.dumps(measure(make_app(WerkzeugPathGadget), args), indent=2))
+
+    failures = [
+        f"{name} {value:.1f} > {limit}"
+        for name, value, limit in (
+            ("peakBytes", result["peakBytes"], args.max_bytes),
+            ("gen0Per1k", result["gen0Per1k"], args.max_gen0),
+            ("leakedBlocks", result["leakedBlocks"], args.max_leaked_blocks),
+            ("rssGrowthMb", result["rssGrowthMb"], args.max_rss_growth),
+        )
+        if value > limit
+    ]
+    if failures:
+        print("Over budget: " + ", ".join(failures))
+        sys.exit(1)
+    print("Within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+# echo_hot_reload.py から読み込まれるハンドラ。保存するとプロセスを再起動せずに差し替わる
+def handle(data):
+    return f"echo: {data}"
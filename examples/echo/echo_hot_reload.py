@@ -0,0 +1,16 @@
+from metagadget import MetaGadget
+
+import echo_handler
+
+
+def main():
+    app = MetaGadget()
+    app.receive(echo_handler.handle)
+    # echo_handler.py を書き換えると、ハンドラだけが読み込み直される
+    app.hot_reload(echo_handler)
+
+    app.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
-import RPi.GPIO as GPIO
+import logging
+import os
 import sys
-from metagadget import MetaGadget
+from metagadget import MetaGadget, hardware
+
+logger = logging.getLogger("fan")
 
 # ピンの設定
 FAN1_PIN = 18
@@ -9,47 +12,78 @@ FAN2_PIN = 19
 # PWMの周波数
 FREQUENCY = 1000
 
-# GPIOの初期設定
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(FAN1_PIN, GPIO.OUT)
-GPIO.setup(FAN2_PIN, GPIO.OUT)
-
-pwm_fan1 = GPIO.PWM(FAN1_PIN, FREQUENCY)
-pwm_fan2 = GPIO.PWM(FAN2_PIN, FREQUENCY)
-
-pwm_fan1.start(0)
-pwm_fan2.start(0)
+# 最後に設定したデューティー比を残すファイル。再起動したときはこの値から動き始める
+CHECKPOINT_PATH = os.environ.get("FAN_CHECKPOINT", "fan.ckpt")
 
 def set_fan_duty_cycle(pwm, duty_cycle):
     pwm.ChangeDutyCycle(duty_cycle)
 
-def main():
+
+def parse_duties(data):
+    try:
+        fan1_duty, fan2_duty = map(float, data.split())
+    except (AttributeError, ValueError):
+        return None
+    return fan1_duty, fan2_duty
+
+
+def duties_in_range(duties):
+    return duties is not None and all(0 <= duty <= 100 for duty in duties)
+
+
+def create_app(checkpoint_path=None):
+    # METAGADGET_HARDWARE=sim なら実機がなくても動く
+    GPIO = hardware.gpio()
+
+    # GPIOの初期設定
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(FAN1_PIN, GPIO.OUT)
+    GPIO.setup(FAN2_PIN, GPIO.OUT)
+
+    pwm_fan1 = GPIO.PWM(FAN1_PIN, FREQUENCY)
+    pwm_fan2 = GPIO.PWM(FAN2_PIN, FREQUENCY)
+
+    pwm_fan1.start(0)
+    pwm_fan2.start(0)
+
     app = MetaGadget()
 
     @app.receive
     def handle(data):
-        try:
-            fan1_duty, fan2_duty = map(float, data.split())
-        except ValueError:
-            print("入力が不正です。2つの数値をスペースで区切って入力してください。")
+        duties = parse_duties(data)
+        if duties is None:
+            logger.warning("入力が不正です。2つの数値をスペースで区切って入力してください。", extra={"data": data})
             return
+        fan1_duty, fan2_duty = duties
 
         if 0 <= fan1_duty <= 100:
             set_fan_duty_cycle(pwm_fan1, fan1_duty)
         else:
-            print("ファン1のデューティー比は0から100の間で入力してください。")
+            logger.warning("ファン1のデューティー比は0から100の間で入力してください。", extra={"duty": fan1_duty})
 
         if 0 <= fan2_duty <= 100:
             set_fan_duty_cycle(pwm_fan2, fan2_duty)
         else:
-            print("ファン2のデューティー比は0から100の間で入力してください。")
+            logger.warning("ファン2のデューティー比は0から100の間で入力してください。", extra={"duty": fan2_duty})
 
-    app.run()
+    if checkpoint_path:
+        # 両方のファンに設定できたコマンドだけを残す。"150 70" のように片方を弾いたコマンドを残すと、
+        # 起動時にそのファンだけ前の値のままになる。起動時はリクエストを受ける前に同じコマンドで handle を呼ぶ
+        app.checkpoint(checkpoint_path, key=lambda data: "fans" if duties_in_range(parse_duties(data)) else None)
+
+    def cleanup():
+        pwm_fan1.stop()
+        pwm_fan2.stop()
+        GPIO.cleanup()
 
-    pwm_fan1.stop()
-    pwm_fan2.stop()
-    GPIO.cleanup()
+    return app, cleanup
+
+
+def main():
+    app, cleanup = create_app(CHECKPOINT_PATH)
+    app.run()
+    cleanup()
     sys.exit(0)
 
 if __name__ == "__main__":
@@ -1,65 +1,78 @@
+import logging
 import os
-import pygame
-import RPi.GPIO as GPIO
 import sys
-from metagadget import MetaGadget
+from metagadget import MetaGadget, hardware
 import time
+
+logger = logging.getLogger("haptics")
+
 # GPIO設定
 LED_PIN = 17
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(LED_PIN, GPIO.OUT)
-
-# pygame初期化
-pygame.mixer.init()
 
 def list_audio_files(directory):
     files = [f for f in os.listdir(directory) if f.endswith('.wav')]
-    for i, file in enumerate(files, start=1):
-        print(f"{i}: {file}")
+    # 呼ばれるたびにディレクトリの中身を出力すると遅いコンソールで待たされるので、デバッグ時だけ記録する
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Audio files", extra={"directory": directory, "files": files})
     return files
 
-def play_audio_file(file_path, volume):
-    pygame.mixer.music.load(file_path)
-    pygame.mixer.music.set_volume(volume / 100.0)
-    pygame.mixer.music.play(-1)  # ループ再生
+def play_audio_file(mixer, file_path, volume):
+    mixer.music.load(file_path)
+    mixer.music.set_volume(volume / 100.0)
+    mixer.music.play(-1)  # ループ再生
 
-def stop_audio():
-    pygame.mixer.music.stop()
+def stop_audio(mixer):
+    mixer.music.stop()
+
+def create_app(audio_dir='data', play_seconds=3):
+    # METAGADGET_HARDWARE=sim なら実機がなくても動く
+    GPIO = hardware.gpio()
+    mixer = hardware.mixer()
+
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(LED_PIN, GPIO.OUT)
+
+    # pygame初期化
+    mixer.init()
 
-def main():
     app = MetaGadget()
-    audio_dir = 'data'
-    
+
     @app.receive
     def handle(data):
         try:
             file_index, volume = map(int, data.split())
         except ValueError:
-            print("入力が不正です。ファイル番号と音量をスペースで区切って入力してください。")
+            logger.warning("入力が不正です。ファイル番号と音量をスペースで区切って入力してください。", extra={"data": data})
             return
 
         files = list_audio_files(audio_dir)
-        
+
         if 0 <= file_index - 1 < len(files):
             file_path = os.path.join(audio_dir, files[file_index - 1])
             if 0 <= volume <= 100:
-                print(f"{files[file_index - 1]} を音量 {volume} で再生します。")
+                logger.info("%s を音量 %d で再生します。", files[file_index - 1], volume)
                 GPIO.output(LED_PIN, GPIO.HIGH)
-                play_audio_file(file_path, volume)
-                time.sleep(3)
-                stop_audio()
+                play_audio_file(mixer, file_path, volume)
+                time.sleep(play_seconds)
+                stop_audio(mixer)
             else:
-                print("音量は0から100の範囲で入力してください。")
+                logger.warning("音量は0から100の範囲で入力してください。", extra={"volume": volume})
         else:
-            print("ファイル番号が無効です。")
+            logger.warning("ファイル番号が無効です。", extra={"fileIndex": file_index})
 
-    app.run()
+    def cleanup():
+        stop_audio(mixer)
+        GPIO.output(LED_PIN, GPIO.LOW)
+        GPIO.cleanup()
+        mixer.quit()
 
-    stop_audio()
-    GPIO.output(LED_PIN, GPIO.LOW)
-    GPIO.cleanup()
-    pygame.mixer.quit()
+    return app, cleanup
+
+def main():
+    app, cleanup = create_app()
+    app.run()
+    cleanup()
     sys.exit(0)
 
 if __name__ == "__main__":
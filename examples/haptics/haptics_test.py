@@ -1,6 +1,8 @@
 import os
-import pygame
-import RPi.GPIO as GPIO
+from metagadget import hardware
+# METAGADGET_HARDWARE=sim なら実機がなくても動く
+GPIO = hardware.gpio()
+mixer = hardware.mixer()
 import sys
 
 # GPIO設定
@@ -10,7 +12,7 @@ GPIO.setmode(GPIO.BCM)
 GPIO.setup(LED_PIN, GPIO.OUT)
 
 # pygame初期化
-pygame.mixer.init()
+mixer.init()
 
 def list_audio_files(directory):
     files = [f for f in os.listdir(directory) if f.endswith('.wav')]
@@ -19,12 +21,12 @@ def list_audio_files(directory):
     return files
 
 def play_audio_file(file_path, volume):
-    pygame.mixer.music.load(file_path)
-    pygame.mixer.music.set_volume(volume / 100.0)
-    pygame.mixer.music.play(-1)  # ループ再生
+    mixer.music.load(file_path)
+    mixer.music.set_volume(volume / 100.0)
+    mixer.music.play(-1)  # ループ再生
 
 def stop_audio():
-    pygame.mixer.music.stop()
+    mixer.music.stop()
 
 def main():
     audio_dir = 'data'
@@ -77,7 +79,7 @@ def main():
         stop_audio()
         GPIO.output(LED_PIN, GPIO.LOW)
         GPIO.cleanup()
-        pygame.mixer.quit()
+        mixer.quit()
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -1,27 +1,46 @@
-import RPi.GPIO as GPIO
-from metagadget import MetaGadget
+import os
+
+from metagadget import MetaGadget, hardware
 
 # PIN Number
 LED_PIN = 14
 
-# GPIO Setup
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(LED_PIN, GPIO.OUT)
+# 最後の点灯状態を残すファイル。再起動したときはこの状態に戻してからリクエストを受ける
+CHECKPOINT_PATH = os.environ.get("LED_CHECKPOINT", "led.ckpt")
 
 
-def main():
+def create_app(checkpoint_path=None):
+    # METAGADGET_HARDWARE=sim なら実機がなくても動く
+    GPIO = hardware.gpio()
+
+    # GPIO Setup
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(LED_PIN, GPIO.OUT)
+
     app = MetaGadget()
 
-    @app.receive
+    # 点灯と消灯は触った感覚に直結するので interactive レーンで実行する。
+    # ワーカーが2つあると続けて届いた on と off が入れ替わることがあるので、届いた順に1つずつ実行する
+    app.lane("interactive", 1)
+
+    @app.receive(priority="interactive")
     def handle(data):
         if data == "on":
             GPIO.output(LED_PIN, 1)
         else:
             GPIO.output(LED_PIN, 0)
 
+    if checkpoint_path:
+        app.checkpoint(checkpoint_path)
+
+    return app, GPIO.cleanup
+
+
+def main():
+    app, cleanup = create_app(CHECKPOINT_PATH)
     app.run()
-    GPIO.cleanup()
+    cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+import json
+import os
+
+from metagadget import MetaGadget, ClockSync, hardware
+
+# PIN Number
+LED_PIN = 14
+# Cluster のイベントからこの秒数後に、同じイベントを受けたガジェットがそろって点灯・消灯する
+FIRE_DELAY = float(os.environ.get("FIRE_DELAY", 0.15))
+
+
+def create_app():
+    # METAGADGET_HARDWARE=sim なら実機がなくても動く
+    GPIO = hardware.gpio()
+
+    # GPIO Setup
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(LED_PIN, GPIO.OUT)
+
+    app = MetaGadget()
+    clock = ClockSync(min_latency=float(os.environ.get("MIN_LATENCY", 0.0)))
+
+    # リクエストは {"time": Date.now(), "isGrab": 1} の形で送る
+    @app.receive(priority="interactive")
+    def handle(request):
+        data = json.loads(request)
+        if data.get("stats"):
+            return clock.stats()
+        clock.observe(data['time'])
+        clock.schedule(data['time'], FIRE_DELAY, GPIO.output, LED_PIN, 1 if data['isGrab'] == 1 else 0)
+
+    return app, GPIO.cleanup
+
+
+def main():
+    app, cleanup = create_app()
+    app.run()
+    cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
-import RPi.GPIO as GPIO
+import logging
+import os
 import sys
-from metagadget import MetaGadget
+from metagadget import MetaGadget, hardware
+
+logger = logging.getLogger("neck_cooler")
 
 # ピンの設定
 PEL_L_PHASE = 17
@@ -14,32 +17,11 @@ PEL_STANDBY = 24
 # PWMの周波数
 FREQUENCY = 1000
 
-# GPIOの初期設定
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(PEL_L_PHASE, GPIO.OUT)
-GPIO.setup(PEL_L_ENABLE, GPIO.OUT)
-GPIO.setup(PEL_R_PHASE, GPIO.OUT)
-GPIO.setup(PEL_R_ENABLE, GPIO.OUT)
-GPIO.setup(FAN_L, GPIO.OUT)
-GPIO.setup(FAN_R, GPIO.OUT)
-GPIO.setup(PEL_STANDBY, GPIO.OUT)
-
-# ペルチェのスタンバイピンをHighに設定
-GPIO.output(PEL_STANDBY, GPIO.HIGH)
-
-pwm_pel_l = GPIO.PWM(PEL_L_ENABLE, FREQUENCY)
-pwm_pel_r = GPIO.PWM(PEL_R_ENABLE, FREQUENCY)
-pwm_fan_l = GPIO.PWM(FAN_L, FREQUENCY)
-pwm_fan_r = GPIO.PWM(FAN_R, FREQUENCY)
+# 最後に設定したデューティー比を残すファイル。再起動したときはこの値から動き始める
+CHECKPOINT_PATH = os.environ.get("NECK_COOLER_CHECKPOINT", "neck_cooler.ckpt")
 
-pwm_pel_l.start(0)
-pwm_pel_r.start(0)
-pwm_fan_l.start(0)
-pwm_fan_r.start(0)
 
-
-def set_peltier(pwm, phase_pin, duty_cycle):
+def set_peltier(GPIO, pwm, phase_pin, duty_cycle):
     if duty_cycle >= 0:
         GPIO.output(phase_pin, GPIO.LOW)  # 加熱
     else:
@@ -48,19 +30,59 @@ def set_peltier(pwm, phase_pin, duty_cycle):
     pwm.ChangeDutyCycle(duty_cycle)
 
 
-def main():
+def parse_duties(data):
+    try:
+        left_duty, right_duty = map(float, data.split())
+    except (AttributeError, ValueError):
+        return None
+    return left_duty, right_duty
+
+
+def duties_in_range(duties):
+    # 負の値は冷却。絶対値がデューティー比になる
+    return duties is not None and all(-100 <= duty <= 100 for duty in duties)
+
+
+def create_app(checkpoint_path=None):
+    # METAGADGET_HARDWARE=sim なら実機がなくても動く
+    GPIO = hardware.gpio()
+
+    # GPIOの初期設定
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(PEL_L_PHASE, GPIO.OUT)
+    GPIO.setup(PEL_L_ENABLE, GPIO.OUT)
+    GPIO.setup(PEL_R_PHASE, GPIO.OUT)
+    GPIO.setup(PEL_R_ENABLE, GPIO.OUT)
+    GPIO.setup(FAN_L, GPIO.OUT)
+    GPIO.setup(FAN_R, GPIO.OUT)
+    GPIO.setup(PEL_STANDBY, GPIO.OUT)
+
+    # ペルチェのスタンバイピンをHighに設定
+    GPIO.output(PEL_STANDBY, GPIO.HIGH)
+
+    pwm_pel_l = GPIO.PWM(PEL_L_ENABLE, FREQUENCY)
+    pwm_pel_r = GPIO.PWM(PEL_R_ENABLE, FREQUENCY)
+    pwm_fan_l = GPIO.PWM(FAN_L, FREQUENCY)
+    pwm_fan_r = GPIO.PWM(FAN_R, FREQUENCY)
+
+    pwm_pel_l.start(0)
+    pwm_pel_r.start(0)
+    pwm_fan_l.start(0)
+    pwm_fan_r.start(0)
+
     app = MetaGadget()
 
     @app.receive
     def hundle(data):
-        try:
-            left_duty, right_duty = map(float, data.split())
-        except ValueError:
-            print("入力が不正です。2つの数値をスペースで区切って入力してください。")
+        duties = parse_duties(data)
+        if duties is None:
+            logger.warning("入力が不正です。2つの数値をスペースで区切って入力してください。", extra={"data": data})
             return
+        left_duty, right_duty = duties
 
-        set_peltier(pwm_pel_l, PEL_L_PHASE, left_duty)
-        set_peltier(pwm_pel_r, PEL_R_PHASE, right_duty)
+        set_peltier(GPIO, pwm_pel_l, PEL_L_PHASE, left_duty)
+        set_peltier(GPIO, pwm_pel_r, PEL_R_PHASE, right_duty)
 
         # ファンの制御
         if left_duty != 0:
@@ -73,13 +95,24 @@ def main():
         else:
             pwm_fan_r.ChangeDutyCycle(0)
 
-    app.run()
+    if checkpoint_path:
+        # 範囲内のデューティー比だけを残す。起動時はリクエストを受ける前に同じコマンドで hundle を呼ぶ
+        app.checkpoint(checkpoint_path, key=lambda data: "peltier" if duties_in_range(parse_duties(data)) else None)
 
-    pwm_pel_l.stop()
-    pwm_pel_r.stop()
-    pwm_fan_l.stop()
-    pwm_fan_r.stop()
-    GPIO.cleanup()
+    def cleanup():
+        pwm_pel_l.stop()
+        pwm_pel_r.stop()
+        pwm_fan_l.stop()
+        pwm_fan_r.stop()
+        GPIO.cleanup()
+
+    return app, cleanup
+
+
+def main():
+    app, cleanup = create_app(CHECKPOINT_PATH)
+    app.run()
+    cleanup()
     sys.exit(0)
 
 if __name__ == "__main__":
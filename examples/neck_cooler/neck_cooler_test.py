@@ -1,4 +1,5 @@
-import RPi.GPIO as GPIO
+from metagadget import hardware
+GPIO = hardware.gpio()  # METAGADGET_HARDWARE=sim なら実機がなくても動く
 import time
 import threading
 import sys
@@ -0,0 +1,99 @@
+"""
+Runs the router with local processes standing in for the Raspberry Pis on the LAN.
+
+Starts one node per address in routes.json, sends requests through the router, stops the preferred
+"led" node to show failover, and prints the aggregated metrics.
+
+    VERIFY_TOKEN=x python examples/router/local_cluster.py [--requests 200]
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+os.environ.setdefault("VERIFY_TOKEN", "local")
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from metagadget import Router  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROUTER_PORT = 5100
+
+
+def start_nodes(router):
+    procs = {}
+    env = dict(os.environ, PYTHONPATH=os.path.join(HERE, "..", ".."))
+    for address in router._nodes:
+        host, port = address.rsplit(":", 1)
+        procs[address] = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "node.py"), address, "--host", host, "--port", port],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return procs
+
+
+def wait_healthy(router, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        router.check_health()
+        if all(node.healthy for node in router._nodes.values()):
+            return
+        time.sleep(0.2)
+    raise RuntimeError("Nodes did not come up")
+
+
+def call(conn, key, request):
+    body = json.dumps({"request": request})
+    conn.request("POST", f"/{key}", body, {"Content-Type": "application/json"})
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, json.loads(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    router = Router.from_file(os.path.join(HERE, "routes.json"))
+    procs = start_nodes(router)
+    server = make_server("127.0.0.1", ROUTER_PORT, router, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        wait_healthy(router)
+        router.start()
+        conn = http.client.HTTPConnection("127.0.0.1", ROUTER_PORT)
+        t = time.perf_counter()
+        for i in range(args.requests):
+            key = ("led", "fan", "haptics")[i % 3]
+            status, body = call(conn, key, f"{key} {i}")
+            assert status == 200, (status, body)
+        elapsed = time.perf_counter() - t
+        print(f"{args.requests} requests through the router: {elapsed / args.requests * 1000:.2f} ms/request")
+        print("led ->", call(conn, "led", "on")[1]["response"]["node"])
+
+        # 優先されている led のノードを止めると、次のリクエストから予備のノードに回る
+        first = router.routes["led"][0].address
+        procs[first].terminate()
+        procs[first].wait()
+        print(f"stopped {first}; led ->", call(conn, "led", "on")[1]["response"]["node"])
+        print("unknown ->", call(conn, "nope", "on"))
+        print(json.dumps(router.metrics(), indent=2))
+    finally:
+        server.shutdown()
+        router.stop()
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
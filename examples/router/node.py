@@ -0,0 +1,26 @@
+import argparse
+import os
+
+from metagadget import MetaGadget
+
+# ルーターの後ろで動くガジェットの代わり。Raspberry Pi 上ではここで GPIO などを操作する
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name")
+    parser.add_argument("--host", default=os.environ.get("METAGADGET_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=5001)
+    args = parser.parse_args()
+
+    app = MetaGadget()
+    @app.receive
+    def handle(data):
+        return {"node": args.name, "request": data}
+
+    # ngrok はルーターだけが使うので、ノードはトンネルを張らない。止めたときに子プロセスが残らないようリローダーも使わない
+    app.run(host=args.host, port=args.port, tunnel=False, reloader=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import inspect
+import timeit
+
+from switchbot_client.case_insensitive_invoke_mixin import CaseInsensitiveInvokeMixin
+from switchbot_client.switchbot_client import SwitchBotClient
+
+# CaseInsensitiveInvokeMixin のクライアント生成とメソッド探索のコストを測る
+# Micro-benchmark for client construction and method lookup through CaseInsensitiveInvokeMixin.
+# usage: python bench_case_insensitive_invoke.py
+
+NUMBER = 100_000
+
+
+class LegacyLookup:
+    """
+    インスタンスごとに辞書を作り、探索のたびに名前を正規化していた以前の実装。比較用
+    """
+    def __init__(self):
+        routines = filter(lambda x: not x[0].startswith('__'), inspect.getmembers(self, inspect.isroutine))
+        self.__routines = {name.lower().replace('_', ''): func for name, func in routines}
+
+    def __getattr__(self, item):
+        routines_attr = self.__routines
+        try:
+            return self.__getattribute__(item)
+        except AttributeError:
+            pass
+        try:
+            return routines_attr[item.lower().replace('_', '')]
+        except KeyError:
+            raise AttributeError(f"AttributeError: {item} is not found")
+
+
+class LegacySwitchBotClient(SwitchBotClient):
+    def __init__(self, token: str, secret: str):
+        super().__init__(token, secret)
+        LegacyLookup.__init__(self)
+
+    __getattr__ = LegacyLookup.__getattr__
+
+
+def report(label: str, seconds: float, number: int):
+    print(f"{label:<40} {seconds / number * 1e9:10.1f} ns/op")
+
+
+def main():
+    for cls, setup in ((LegacySwitchBotClient, LegacyLookup.__init__), (SwitchBotClient, CaseInsensitiveInvokeMixin.__init__)):
+        print(f"# {cls.__name__}")
+        # クライアントの生成は httpx.Client の SSL コンテキストの作成が大半を占めるので、作っておいたクライアントで
+        # メソッド探索の準備 (Mixin の __init__) だけを測る
+        client = cls("token", "secret")
+        number = NUMBER // 100
+        report("lookup setup per instance", timeit.timeit(lambda: setup(client), number=number), number)
+        report("lookup exact name (bot_press)", timeit.timeit(lambda: getattr(client, "bot_press"), number=NUMBER), NUMBER)
+        report("lookup camelCase name (botPress)", timeit.timeit(lambda: getattr(client, "botPress"), number=NUMBER), NUMBER)
+        report("lookup missing name", timeit.timeit(lambda: getattr(client, "noSuchMethod", None), number=NUMBER), NUMBER)
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import json
+import timeit
+
+from metagadget import RPC
+from switchbot_client.switchbot_models import SBListDeviceResponse
+
+# list_devices の結果をまるごと返す場合と、fields で必要なフィールドだけを返す場合のエンコードの時間と応答のサイズを比べる
+# fields は応答を小さくするためのもので、エンコードはまるごと返す場合 (model_dump_json) より遅い
+# Benchmark encoding a list_devices result with and without field projection. Projection shrinks the
+# response; it is slower to encode than the full model_dump_json.
+# usage: python bench_field_projection.py
+
+NUMBER = 200
+REPEAT = 10
+DEVICES = 300
+FIELD_SETS = [
+    None,
+    ["body.deviceList.deviceId"],
+    ["body.deviceList.deviceId", "body.deviceList.deviceName"],
+    ["statusCode", "body.deviceList.deviceType"],
+]
+
+
+def previous_encode(response):
+    # 以前の実装: model_dump で辞書にしてから json.dumps する
+    return json.dumps({"result": response.model_dump(mode="json")}, separators=(',', ':'))
+
+
+def main():
+    response = SBListDeviceResponse.model_validate({"statusCode": 100, "message": "success", "body": {"deviceList": [
+        {"deviceId": f"CDC10B{i:06X}", "deviceName": f"Device {i}", "deviceType": "Bot", "hubDeviceId": "E2F6A3B1C4D5"}
+        for i in range(DEVICES)]}})
+    rpc = RPC()
+    rpc.register(lambda: response, name="list_devices")
+
+    previous = min(timeit.repeat(lambda: previous_encode(response), number=NUMBER, repeat=REPEAT)) / NUMBER
+    print(f"{'fields':<64} {'time':>10} {'bytes':>8}")
+    print(f"{'(previous: model_dump + json.dumps)':<64} {previous * 1e6:7.1f} us {len(previous_encode(response)):>8}")
+    for fields in FIELD_SETS:
+        request = {"functionName": "list_devices"}
+        if fields is not None:
+            request["fields"] = fields
+        data = json.dumps(request)
+        elapsed = min(timeit.repeat(lambda: rpc.handle(data), number=NUMBER, repeat=REPEAT)) / NUMBER
+        print(f"{str(fields or '(all)'):<64} {elapsed * 1e6:7.1f} us {len(rpc.handle(data)):>8}")
+
+
+if __name__ == "__main__":
+    main()
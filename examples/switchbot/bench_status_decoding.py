@@ -0,0 +1,39 @@
+import json
+import timeit
+
+from switchbot_client import switchbot_models
+from switchbot_client.status_decoder import decode_status
+from switchbot_client.switchbot_models import SBDeviceStatusResponse
+
+# 記録しておいた9種類のステータスのレスポンスで、デコードのコストを測る
+# Benchmark status decoding over recorded responses for every status body type.
+# usage: python bench_status_decoding.py
+
+NUMBER = 20_000
+SAMPLES_PATH = "data/status_samples.json"
+
+
+def previous_path(raw: bytes, body_cls):
+    # 以前の実装: res.json() で辞書にしてから、呼び出しのたびにパラメータ化したモデルで検証する
+    return SBDeviceStatusResponse[body_cls].model_validate(json.loads(raw))
+
+
+def main():
+    with open(SAMPLES_PATH) as f:
+        samples = json.load(f)
+
+    print(f"{'status body':<24} {'previous':>12} {'cached':>12} {'2 fields':>12}")
+    for name, response in samples.items():
+        body_cls = getattr(switchbot_models, name)
+        raw = json.dumps(response).encode()
+        fields = list(body_cls.model_fields)[:2]
+        assert decode_status(raw, body_cls) == previous_path(raw, body_cls)
+
+        previous = timeit.timeit(lambda: previous_path(raw, body_cls), number=NUMBER)
+        cached = timeit.timeit(lambda: decode_status(raw, body_cls), number=NUMBER)
+        partial = timeit.timeit(lambda: decode_status(raw, body_cls, fields), number=NUMBER)
+        print(f"{name:<24} {previous / NUMBER * 1e6:9.2f} us {cached / NUMBER * 1e6:9.2f} us {partial / NUMBER * 1e6:9.2f} us")
+
+
+if __name__ == "__main__":
+    main()
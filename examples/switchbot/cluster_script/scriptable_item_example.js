@@ -1,3 +1,4 @@
+// デバイスIDの代わりにデバイス名 ("Desk Bot") や "type:Bot" (その種類のデバイスが1台だけの場合) も使える
 const BOT_DEVICE_ID = "CDC10B...";
 
 function setLight(isOn, r = 0.14, g = 0.74, b = 0.52, brightness = 1.0) {
@@ -16,17 +17,22 @@ function assert(condition, message) {
   }
 }
 
-function callMetaGadget(functionName, args, kwargs, meta) {
+// fields: 結果のうち必要なフィールドだけを返させる。例: ["body.deviceList.deviceId", "body.deviceList.deviceName"]
+function callMetaGadget(functionName, args, kwargs, meta, fields) {
   assert(typeof(functionName) === "string", `functionName must be a string, but got ${functionName}`);
   assert(args === undefined || Array.isArray(args), `args must be an array, but got ${args}`);
   assert(kwargs === undefined || typeof(kwargs) === "object", `kwargs must be an object, but got ${kwargs}`);
   assert(meta === undefined || typeof(meta) === "string", `meta must be a string, but got ${meta}`);
+  assert(fields === undefined || Array.isArray(fields), `fields must be an array, but got ${fields}`);
 
   const requestBody = {
     "functionName": functionName,
     "args": args,
     "kwargs": kwargs
   }
+  if (fields !== undefined) {
+    requestBody.fields = fields;
+  }
   $.callExternal(JSON.stringify(requestBody), meta || "default meta");
 }
 
@@ -0,0 +1,47 @@
+// stateSnapshot の差分を受け取って、$.state.devices に反映する例
+// {"v": version, "d": {path: value}, "r": [removed paths]} または全体の再同期 {"v": version, "f": {path: value}} が返る
+// version は "<epoch>.<n>" の文字列。ガジェットが再起動すると epoch が変わり、全体の再同期が返る
+
+function requestSnapshot() {
+  const requestBody = {
+    "functionName": "stateSnapshot",
+    "args": [$.state.snapshotVersion || 0],
+    "kwargs": {}
+  }
+  $.callExternal(JSON.stringify(requestBody), "snapshot");
+}
+
+function applySnapshot(snapshot) {
+  if (snapshot.f !== undefined) {
+    $.state.fields = snapshot.f;
+  } else {
+    const fields = $.state.fields || {};
+    for (const path in snapshot.d) {
+      fields[path] = snapshot.d[path];
+    }
+    for (const path of snapshot.r || []) {
+      delete fields[path];
+    }
+    $.state.fields = fields;
+  }
+  $.state.snapshotVersion = snapshot.v;
+}
+
+$.onUpdate(deltaTime => {
+  const now = Date.now();
+  if (now - ($.state.lastPolled || 0) > 5000) {
+    $.state.lastPolled = now;
+    requestSnapshot();
+  }
+})
+
+$.onExternalCallEnd((response, meta, errorReason) => {
+  if (meta !== "snapshot" || response === null) {
+    return;
+  }
+  const res = JSON.parse(response);
+  if (res.result !== undefined) {
+    applySnapshot(res.result);
+    $.log(`power of CDC10B...: ${$.state.fields["devices.CDC10B....power"]}`);
+  }
+})
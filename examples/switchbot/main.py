@@ -1,38 +1,74 @@
-import json
+import atexit
 import os
-import traceback
-from typing import Optional, Any
-
-from pydantic import BaseModel, Field
+import signal
+import sys
 
+from switchbot_client.device_state_store import SwitchBotDeviceStateStore
+from switchbot_client.quota_scheduler import QuotaScheduler
+from switchbot_client.sensor_sampler import SensorSampler
 from switchbot_client.switchbot_client import SwitchBotClient
-from metagadget import MetaGadget
+from metagadget import MetaGadget, RPC, StateSnapshot, deadline
+
+HANDLER_TIMEOUT = float(os.environ.get("HANDLER_TIMEOUT", 5.0))
+# カンマ区切りのデバイスID。CO2 センサーや温湿度計を定期的に読み取ってリングバッファに貯める
+SENSOR_DEVICES = [d for d in os.environ.get("SWITCHBOT_SENSOR_DEVICES", "").split(",") if d]
+SENSOR_POLL_INTERVAL = float(os.environ.get("SWITCHBOT_SENSOR_POLL_INTERVAL", 60.0))
+# シーンの実行や状態の取得は待たせてもよいので bulk レーンで実行し、デバイスの操作を先に通す
+# ローカルシーンで同時に送るコマンドの数。スケジューラの INTERACTIVE の同時実行数も同じにして、並列なステップを待たせない
+SCENE_WORKERS = int(os.environ.get("SWITCHBOT_SCENE_WORKERS", 8))
+BULK_METHODS = {"list_devices", "list_scenes", "execute_scene", "run_local_scene", "setup_webhook"}
+
 
-class SmartHomeRequest(BaseModel):
-    function_name: str = Field(..., title="func_name", alias="functionName")
-    args: Optional[list[Any]] = Field(..., title="args")
-    kwargs: Optional[dict[str, Any]] = Field(..., title="kwargs")
+def method_priority(name):
+    if name in BULK_METHODS or name.endswith("get_device_status"):
+        return "bulk"
+    return "interactive"
 
 
 def main():
     app = MetaGadget()
-    switchbot_client = SwitchBotClient(os.environ.get("SWITCHBOT_TOKEN"), os.environ.get("SWITCHBOT_SECRET"))
-
-    @app.receive
-    def handle(data):
-        sh_req = SmartHomeRequest.model_validate_json(data)
-        # Remote Procedure Call
-        try:
-            func = getattr(switchbot_client, sh_req.function_name)
-            ret = func(*sh_req.args, **sh_req.kwargs)
-            if isinstance(ret, BaseModel):
-                ret = ret.model_dump_json()
-            return ret
-        except Exception:
-            traceback.print_exc()
-            mes = traceback.format_exc()[:500]
-            return json.dumps({"error": mes})
+    scheduler = QuotaScheduler(state_path=os.environ.get("SWITCHBOT_QUOTA_STATE", "switchbot_quota.json"),
+                               max_concurrency=2, max_interactive_concurrency=SCENE_WORKERS)
+    state_store = SwitchBotDeviceStateStore()
+    # デバイスの状態の変化をバージョン付きのスナップショットに反映し、Cluster には差分だけを返す
+    snapshot = StateSnapshot()
+    state_store.add_listener(lambda device_id, body: snapshot.update(f"devices.{device_id}", body))
+    switchbot_client = SwitchBotClient(os.environ.get("SWITCHBOT_TOKEN"), os.environ.get("SWITCHBOT_SECRET"),
+                                       scheduler=scheduler, state_store=state_store, timeout_provider=deadline.remaining,
+                                       max_scene_workers=SCENE_WORKERS)
+    # Webhook で届いた値もポーリングした値もリングバッファに入る。sensor_window は上流を呼ばない
+    # ポーリングはキャッシュと Webhook の状態を通さずに上流から読む。そうしないと同じ値を何度も記録する
+    sampler = SensorSampler(switchbot_client.poll_device_status, interval=SENSOR_POLL_INTERVAL)
+    state_store.add_listener(sampler.ingest)
+    for device_id in SENSOR_DEVICES:
+        sampler.track(device_id)
+    if SENSOR_DEVICES:
+        # リクエストを処理するプロセスで読み取る (リローダーを使う場合は子プロセス側)
+        sampler.start()
+
+    # SwitchBot からの状態変化の通知を受け取る。ngrok のドメインに合わせて SWITCHBOT_WEBHOOK_URL を設定すると登録する
+    @app.webhook("/switchbot/webhook")
+    def handle_webhook(data):
+        state_store.apply_webhook(data)
+
+    if os.environ.get("SWITCHBOT_WEBHOOK_URL") and not os.environ.get("WERKZEUG_RUN_MAIN"):
+        switchbot_client.setup_webhook(os.environ["SWITCHBOT_WEBHOOK_URL"])
+
+    # Remote Procedure Call. {"functionName": "botPress", "args": [...], "kwargs": {...}} を SwitchBotClient のメソッドに渡す
+    rpc = RPC()
+    rpc.register_object(switchbot_client, SwitchBotClient.invocable_methods, priority=method_priority)
+    rpc.register(snapshot.encode_delta, name="state_snapshot", priority="interactive")
+    rpc.register(sampler.window, name="sensor_window", priority="interactive")
+    rpc.register(sampler.summary, name="sensor_summary", priority="interactive")
+    # リクエストは一度だけパースして、呼ばれる関数の優先度でレーンを選ぶ
+    app.parser(rpc.parse)
+    # SwitchBot API が遅いときも、Cluster には HANDLER_TIMEOUT 秒以内に応答する
+    app.receive(rpc.handle_parsed, timeout=HANDLER_TIMEOUT, priority=rpc.priority)
 
+    # リローダーの子プロセスは app.run() から戻らずに終わるので、終了時の書き込みは atexit に任せる。
+    # SIGTERM でも atexit が動くように SystemExit にする
+    atexit.register(scheduler.flush)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run()
 
 
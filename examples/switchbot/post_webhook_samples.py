@@ -0,0 +1,27 @@
+import json
+import sys
+import time
+
+import httpx
+
+# 記録しておいた SwitchBot の Webhook の通知を、ローカルで動いている main.py に送る
+# Post recorded SwitchBot webhook payloads to a locally running main.py, standing in for the SwitchBot cloud.
+# usage: python post_webhook_samples.py [URL] [SAMPLES_JSON]
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:5001/switchbot/webhook"
+    samples_path = sys.argv[2] if len(sys.argv) > 2 else "data/webhook_samples.json"
+    with open(samples_path) as f:
+        samples = json.load(f)
+
+    with httpx.Client() as client:
+        for sample in samples:
+            start = time.perf_counter()
+            res = client.post(url, json=sample)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"{sample['context']['deviceType']:<12} {sample['context']['deviceMac']} -> {res.status_code} ({elapsed:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
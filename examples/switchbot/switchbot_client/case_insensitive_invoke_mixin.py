@@ -1,4 +1,11 @@
 import inspect
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1024)
+def normalize_name(name: str) -> str:
+    # アンダースコアを除去し、すべて小文字にする。plugTurnOn も plug_turn_on も plugturnon になる
+    return name.lower().replace('_', '')
 
 
 class CaseInsensitiveInvokeMixin:
@@ -6,23 +13,28 @@ class CaseInsensitiveInvokeMixin:
     This MixIn allows you to call methods in a case-insensitive manner.
     Case-InsensitiveにメソッドをコールできるようにするMixIn。例えば、plug_turn_onを plugTurnOnでも呼べるようにする
     """
+    # 大文字小文字を区別せずに呼び出せるメソッドの一覧。None の場合は __ で始まらないすべてのメソッドが対象になる
+    invocable_methods: tuple[str, ...] | None = None
+    _invoke_table: dict[str, str] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # 正規化した名前 -> メソッド名 の辞書はインスタンスごとではなくクラスごとに1回だけ作る
+        if cls.invocable_methods is None:
+            names = [name for name, _ in inspect.getmembers(cls, inspect.isroutine) if not name.startswith('__')]
+        else:
+            names = cls.invocable_methods
+            for name in names:
+                assert inspect.isroutine(getattr(cls, name, None)), f"{cls.__name__}.{name} is not a method"
+        cls._invoke_table = {normalize_name(name): name for name in names}
+
     def __init__(self):
-        self.__routines = None
-        # メソッドのリストを作成し、アンダースコアを除去、すべて小文字にしたキーで辞書を作成
-        routines = filter(lambda x: not x[0].startswith('__'), inspect.getmembers(self, inspect.isroutine))
-        self.__routines = {name.lower().replace('_', ''): func for name, func in routines}
+        pass
 
     def __getattr__(self, item):
-        routines_attr = self.__routines
-        # 普通にメソッドが見つかったら、そのメソッドを返す
-        try:
-            return self.__getattribute__(item)
-        except AttributeError:
-            pass # fallthrough
-
-        # そうでない場合、辞書から取得して返す
+        # __getattr__ は通常の属性の探索で見つからなかった場合にだけ呼ばれるので、ここでは辞書だけを引く
         try:
-            ret = routines_attr[item.lower().replace('_', '')]
+            name = type(self)._invoke_table[normalize_name(item)]
         except KeyError:
-            raise AttributeError(f"AttributeError: {item} is not found")
-        return ret
+            raise AttributeError(f"AttributeError: {item} is not found") from None
+        return getattr(self, name)
@@ -0,0 +1,203 @@
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable
+
+from metagadget.rpc import INVALID_PARAMS, RPCError
+from switchbot_client.switchbot_models import ListDeviceBody, SBListDeviceResponse
+
+logger = logging.getLogger(__name__)
+
+# "type:Color Bulb" のように deviceType でデバイスを選ぶ
+TYPE_SELECTOR_PREFIX = "type:"
+# 一覧を読み込めなかった場合に、名前解決のついでに (別スレッドで) 読み込み直すまでの秒数
+LOAD_RETRY_INTERVAL = 30.0
+# デバイスID (MAC アドレスの12桁) と赤外線リモコンのID ("01-202101011234-12345678")。一覧を読まずにそのまま使う
+DEVICE_ID_PATTERN = re.compile(r"[0-9A-F]{12}|\d{2}-\d{12}-\d{8}")
+
+
+def normalize_key(name: str) -> str:
+    # 名前と deviceType は大文字小文字と前後の空白を区別しない
+    return name.strip().casefold()
+
+
+class AmbiguousDeviceError(RPCError):
+    """A device name or selector that matches more than one device. RPC answers it as invalid_params."""
+
+    def __init__(self, ref: str, matches: list[ListDeviceBody]):
+        super().__init__(INVALID_PARAMS,
+                         f"'{ref}' matches {len(matches)} devices: {', '.join(d.deviceName for d in matches)}")
+        self.ref = ref
+        self.matches = matches
+
+
+class _Index:
+    def __init__(self, devices: list[ListDeviceBody]):
+        self.by_id: dict[str, ListDeviceBody] = {}
+        self.by_name: dict[str, list[ListDeviceBody]] = {}
+        self.by_type: dict[str, list[ListDeviceBody]] = {}
+        for device in devices:
+            self.by_id[device.deviceId] = device
+            self.by_name.setdefault(normalize_key(device.deviceName), []).append(device)
+            self.by_type.setdefault(normalize_key(device.deviceType), []).append(device)
+
+
+class SwitchBotDeviceRegistry:
+    """
+    The device list indexed by id, name and deviceType, so that Cluster scripts can address devices by name.
+    Loaded from list_devices on the first lookup and refreshed on a background thread when it is older than
+    refresh_interval; lookups never wait for the SwitchBot API after that.
+    デバイス一覧を ID・名前・deviceType で引けるようにしておき、名前やデバイスの種類から O(1) でデバイスIDを求める
+    """
+    def __init__(self, load: Callable[[], SBListDeviceResponse], refresh_interval: float = 600.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self._load = load
+        self._refresh_interval = refresh_interval
+        self._clock = clock
+        self._load_lock = threading.Lock()
+        self._index: _Index | None = None
+        self._loaded_at: float | None = None
+        self._attempted_at: float | None = None
+        self._refreshing = False
+        self.loads = 0
+        self.load_errors = 0
+        self.resolved = 0
+        self.passed_through = 0
+
+    def update(self, response: SBListDeviceResponse):
+        # 索引を作り直してから差し替えるので、読み取り側はロックを取らない
+        if response.statusCode != 100:
+            return
+        self._index = _Index(response.body.deviceList)
+        self._loaded_at = self._clock()
+
+    def refresh(self) -> bool:
+        with self._load_lock:
+            self._attempted_at = self._clock()
+            try:
+                self.update(self._load())
+            except Exception:
+                self.load_errors += 1
+                logger.exception("Failed to load the SwitchBot device list")
+                return False
+            self.loads += 1
+            return True
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            self._refreshing = False
+
+    def _start_refresh(self):
+        with self._load_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name="switchbot-device-registry", daemon=True).start()
+
+    def _ensure_loaded(self) -> _Index | None:
+        index = self._index
+        if index is None:
+            # 最初の名前解決だけは読み込みを待つ。読み込めなかった場合の読み直しは別スレッドで行い、呼び出し元を待たせない
+            if self._attempted_at is None:
+                self.refresh()
+            elif self._clock() - self._attempted_at >= LOAD_RETRY_INTERVAL and not self._refreshing:
+                self._start_refresh()
+            return self._index
+        if self._clock() - self._loaded_at >= self._refresh_interval and not self._refreshing:
+            # 古くなった一覧はそのまま使い、更新は別スレッドで行う
+            self._start_refresh()
+        return index
+
+    def get(self, device_id: str) -> ListDeviceBody | None:
+        index = self._index
+        return index.by_id.get(device_id) if index is not None else None
+
+    def find(self, ref: str) -> list[ListDeviceBody]:
+        """Devices matching a device ID, a device name or a "type:<deviceType>" selector."""
+        return self._find(self._ensure_loaded(), ref)
+
+    @staticmethod
+    def _find(index: _Index | None, ref: str) -> list[ListDeviceBody]:
+        if index is None:
+            return []
+        device = index.by_id.get(ref)
+        if device is not None:
+            return [device]
+        if ref.startswith(TYPE_SELECTOR_PREFIX):
+            return list(index.by_type.get(normalize_key(ref[len(TYPE_SELECTOR_PREFIX):]), ()))
+        return list(index.by_name.get(normalize_key(ref), ()))
+
+    def resolve(self, ref: str) -> str:
+        """
+        The device ID for a device ID, a device name or a "type:<deviceType>" selector that matches one device.
+        Strings shaped like a device ID are returned without looking at the list; anything else that matches
+        nothing is returned unchanged, e.g. a device added after the last refresh. Raises AmbiguousDeviceError
+        when several devices match.
+        """
+        if DEVICE_ID_PATTERN.fullmatch(ref):
+            self.passed_through += 1
+            return ref
+        index = self._ensure_loaded()
+        if index is not None and ref in index.by_id:
+            return ref
+        matches = self._find(index, ref)
+        if not matches:
+            self.passed_through += 1
+            return ref
+        if len(matches) > 1:
+            raise AmbiguousDeviceError(ref, matches)
+        self.resolved += 1
+        return matches[0].deviceId
+
+    def stats(self) -> dict[str, Any]:
+        index = self._index
+        return {
+            "devices": len(index.by_id) if index is not None else 0,
+            "names": len(index.by_name) if index is not None else 0,
+            "deviceTypes": len(index.by_type) if index is not None else 0,
+            "ageSec": self._clock() - self._loaded_at if self._loaded_at is not None else None,
+            "loads": self.loads,
+            "loadErrors": self.load_errors,
+            "resolved": self.resolved,
+            "passedThrough": self.passed_through,
+        }
+
+
+class SwitchBotDeviceRegistryMixin:
+    """
+    SwitchBotDeviceRegistryMixin lets every device method take a device name or a "type:<deviceType>" selector
+    in place of the device ID. Place it before the state store and the cache so that they see the resolved ID.
+    デバイスIDの代わりにデバイス名や "type:Bot" を受け付ける。状態の置き場とキャッシュには解決したデバイスIDが渡る
+    """
+    def __init__(self, refresh_interval: float = 600.0):
+        self.device_registry = SwitchBotDeviceRegistry(super().list_devices, refresh_interval)
+
+    def list_devices(self):
+        res = super().list_devices()
+        # 呼ばれたついでに索引を新しくする
+        self.device_registry.update(res)
+        return res
+
+    def _get_device_status_raw(self, device_id: str) -> bytes:
+        return super()._get_device_status_raw(self.device_registry.resolve(device_id))
+
+    def _poll_device_status_raw(self, device_id: str) -> bytes:
+        return super()._poll_device_status_raw(self.device_registry.resolve(device_id))
+
+    def commands(self, device_id: str, command: str, command_type: str = "command", parameter: str | int = "default"):
+        return super().commands(self.device_registry.resolve(device_id), command, command_type, parameter)
+
+    def invalidate_device_status(self, device_id: str | None = None):
+        return super().invalidate_device_status(None if device_id is None else self.device_registry.resolve(device_id))
+
+    def resolve_device(self, ref: str) -> str:
+        return self.device_registry.resolve(ref)
+
+    def find_devices(self, ref: str) -> list[ListDeviceBody]:
+        return self.device_registry.find(ref)
+
+    def device_registry_stats(self) -> dict[str, Any]:
+        return self.device_registry.stats()
@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+from typing import Any, Callable
+
+from switchbot_client.switchbot_models import SBWebhookEvent
+
+# Webhook の deviceType を Web API の deviceType に読み替える
+WEBHOOK_DEVICE_TYPES: dict[str, str] = {
+    "WoHand": "Bot",
+    "WoPresence": "Motion Sensor",
+    "WoPlugJP": "Plug Mini (JP)",
+    "WoStrip": "Strip Light",
+    "WoBulb": "Color Bulb",
+    "WoHub2": "Hub 2",
+    "WoFan2": "Circulator Fan",
+}
+
+# Webhook の項目名を Web API のステータスの項目名に読み替える
+WEBHOOK_FIELD_NAMES: dict[str, str] = {
+    "powerState": "power",
+    "detectionState": "moveDetected",
+    "fanMode": "mode",
+}
+
+# ステータスとして保持しない Webhook 固有の項目
+WEBHOOK_META_FIELDS = frozenset({"deviceType", "deviceMac", "timeOfSample", "scale"})
+
+
+def _webhook_field(name: str, value: Any) -> tuple[str, Any]:
+    name = WEBHOOK_FIELD_NAMES.get(name, name)
+    if name == "power" and isinstance(value, str):
+        value = value.lower()
+    elif name == "moveDetected" and isinstance(value, str):
+        value = value == "DETECTED"
+    return name, value
+
+
+class _DeviceState:
+    def __init__(self, body: dict[str, Any], complete: bool, live: bool):
+        self.body = body
+        self.complete = complete  # Web API のステータスで一度でも埋められたか
+        self.live = live  # Webhook が届いているか。届かないデバイスの状態はポーリングした時点のものでしかない
+        self.stale = False
+        self.updated_at = time.monotonic()
+        self.encoded: bytes | None = None  # get_status_raw の結果。状態が変わったら作り直す
+
+
+class SwitchBotDeviceStateStore:
+    """
+    In-memory device state kept up to date by SwitchBot webhook events.
+    Webhook で届く変更を反映し続けるデバイスのステータスの置き場。ステータスの問い合わせに上流を呼ばずに応える
+    """
+    def __init__(self, max_age: float | None = 3600.0):
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._states: dict[str, _DeviceState] = {}
+        self._listeners: list[Callable[[str, dict[str, Any]], None]] = []
+        self.events = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def device_id_from_mac(mac: str) -> str:
+        return mac.replace(":", "").upper()
+
+    def add_listener(self, listener: Callable[[str, dict[str, Any]], None]):
+        self._listeners.append(listener)
+
+    def _notify(self, device_id: str, body: dict[str, Any]):
+        for listener in self._listeners:
+            listener(device_id, body)
+
+    def seed(self, device_id: str, status: dict[str, Any]):
+        # get_device_status の応答で状態を丸ごと置き換える
+        if status.get("statusCode") != 100 or not isinstance(status.get("body"), dict):
+            return
+        body = dict(status["body"])
+        with self._lock:
+            previous = self._states.get(device_id)
+            self._states[device_id] = _DeviceState(body, complete=True, live=previous is not None and previous.live)
+        self._notify(device_id, body)
+
+    def apply_webhook(self, payload: dict[str, Any]) -> str:
+        # 形式の違うペイロードは ValidationError (ValueError) になる
+        event = SBWebhookEvent.model_validate(payload)
+        context = event.context
+        device_id = self.device_id_from_mac(context.deviceMac)
+        changes = dict(_webhook_field(name, value)
+                       for name, value in context.model_dump().items() if name not in WEBHOOK_META_FIELDS)
+        with self._lock:
+            self.events += 1
+            state = self._states.get(device_id)
+            if state is None:
+                body = {"deviceId": device_id,
+                        "deviceType": WEBHOOK_DEVICE_TYPES.get(context.deviceType, context.deviceType)}
+                state = self._states[device_id] = _DeviceState(body, complete=False, live=True)
+            state.live = True
+            state.body.update(changes)
+            state.encoded = None
+            state.stale = False
+            state.updated_at = time.monotonic()
+            body = dict(state.body)
+        self._notify(device_id, body)
+        return device_id
+
+    def mark_stale(self, device_id: str):
+        with self._lock:
+            state = self._states.get(device_id)
+            if state is not None:
+                state.stale = True
+
+    def _fresh_state(self, device_id: str) -> _DeviceState | None:
+        state = self._states.get(device_id)
+        # ポーリングで埋めただけの状態は返さない。その場合の鮮度はキャッシュの TTL に任せる
+        if (state is None or not state.complete or not state.live or state.stale
+                or (self._max_age is not None and time.monotonic() - state.updated_at > self._max_age)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return state
+
+    def get_status(self, device_id: str) -> dict[str, Any] | None:
+        # Web API の get_device_status と同じ形で返す。完全な状態を持っていなければ None
+        with self._lock:
+            state = self._fresh_state(device_id)
+            if state is None:
+                return None
+            return {"statusCode": 100, "message": "success", "body": dict(state.body)}
+
+    def get_status_raw(self, device_id: str) -> bytes | None:
+        with self._lock:
+            state = self._fresh_state(device_id)
+            if state is None:
+                return None
+            if state.encoded is None:
+                state.encoded = json.dumps({"statusCode": 100, "message": "success", "body": state.body}).encode()
+            return state.encoded
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"events": self.events, "hits": self.hits, "misses": self.misses, "devices": len(self._states)}
+
+
+class SwitchBotStateStoreMixin:
+    """
+    SwitchBotStateStoreMixin answers device status reads from a SwitchBotDeviceStateStore when it has the device.
+    Webhook で最新の状態が分かっているデバイスは、上流を呼ばずにステータスを返す
+    """
+    def __init__(self, state_store: SwitchBotDeviceStateStore | None = None):
+        self._state_store = state_store
+
+    def _get_device_status_raw(self, device_id: str) -> bytes:
+        if self._state_store is None:
+            return super()._get_device_status_raw(device_id)
+        raw = self._state_store.get_status_raw(device_id)
+        if raw is None:
+            raw = super()._get_device_status_raw(device_id)
+        return raw
+
+    def _status_fetched(self, device_id: str, raw: bytes):
+        # 上流から読んだ応答だけで状態を置き換える。キャッシュから返した応答で seed すると、
+        # リスナー (センサーのリングバッファなど) に同じ読み取りが何度も届く
+        if self._state_store is not None:
+            try:
+                self._state_store.seed(device_id, json.loads(raw))
+            except ValueError:
+                pass
+        super()._status_fetched(device_id, raw)
+
+    def commands(self, device_id: str, command: str, command_type: str = "command", parameter: str | int = "default"):
+        try:
+            return super().commands(device_id, command, command_type, parameter)
+        finally:
+            # 操作後の状態は次の Webhook か次のポーリングで確定させる
+            if self._state_store is not None:
+                self._state_store.mark_stale(device_id)
+
+    def state_store_stats(self):
+        return self._state_store.stats() if self._state_store is not None else None
@@ -0,0 +1,182 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Self
+
+from pydantic import BaseModel, Field, ValidationError
+
+from metagadget.rpc import INVALID_PARAMS, RPCError
+from switchbot_client.switchbot_base_client import SwitchBotClientProtocol
+
+
+class LocalSceneStep(BaseModel):
+    id: str  # Step ID, unique in the scene
+    device: str  # Device ID to send the command to
+    command: str  # Command, e.g., turnOn, setWindSpeed
+    commandType: str = "command"  # Command type, command or customize
+    parameter: str | int = "default"  # Command parameter
+    after: list[str] = Field(default_factory=list)  # Step IDs that must finish before this step starts
+    delay: float = 0.0  # Seconds to wait after the steps in `after` finish
+
+
+class LocalScene(BaseModel):
+    name: str  # Scene name
+    steps: list[LocalSceneStep]  # Steps of the scene
+
+
+class LocalSceneStepTiming(BaseModel):
+    id: str  # Step ID
+    status: str  # ok, failed or skipped
+    readyMs: float | None = None  # Time when the step's dependencies were satisfied, from the start of the scene
+    startMs: float | None = None  # Time when the command was sent, after the delay
+    endMs: float | None = None  # Time when the response was received
+    durationMs: float | None = None  # Round-trip time of the command
+    response: Any = None  # Response of the command
+    error: str | None = None  # Error message when the step failed
+
+
+class LocalSceneResult(BaseModel):
+    name: str  # Scene name
+    totalMs: float  # Wall-clock time of the whole scene
+    steps: list[LocalSceneStepTiming]  # Timing breakdown in step definition order
+
+
+class CompiledLocalScene:
+    """
+    依存関係を解決済みのシーン。各ステップの後続ステップと、最初に実行できるステップを持つ
+    """
+    def __init__(self, scene: LocalScene):
+        self.scene = scene
+        self.steps: dict[str, LocalSceneStep] = {}
+        for step in scene.steps:
+            if step.id in self.steps:
+                raise RPCError(INVALID_PARAMS, f"Duplicated step id: {step.id}")
+            if step.delay < 0:
+                raise RPCError(INVALID_PARAMS, f"Invalid delay of {step.id}, should be >= 0")
+            self.steps[step.id] = step
+        self.children: dict[str, list[str]] = {step_id: [] for step_id in self.steps}
+        for step in scene.steps:
+            for dep in step.after:
+                if dep not in self.steps:
+                    raise RPCError(INVALID_PARAMS, f"Unknown step id in {step.id}.after: {dep}")
+                self.children[dep].append(step.id)
+        self.roots = [step.id for step in scene.steps if not step.after]
+
+        # トポロジカルソートで循環がないことを確かめる
+        indegree = {step.id: len(step.after) for step in scene.steps}
+        queue = list(self.roots)
+        for step_id in queue:
+            for child in self.children[step_id]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    queue.append(child)
+        if len(queue) != len(self.steps):
+            raise RPCError(INVALID_PARAMS, f"Scene {scene.name} has a dependency cycle")
+
+
+class LocalSceneEngine:
+    """
+    LocalSceneEngine runs a local scene as a dependency graph, sending independent steps concurrently.
+    ローカルで定義したシーンを依存関係のグラフとして実行する。依存関係のないステップは並行して送る
+    """
+    def __init__(self, client: SwitchBotClientProtocol, max_workers: int = 8):
+        self._client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="local-scene")
+        self._lock = threading.Lock()
+        self._scenes: dict[str, CompiledLocalScene] = {}
+
+    @staticmethod
+    def _compile(scene: LocalScene | dict[str, Any]) -> CompiledLocalScene:
+        try:
+            scene = LocalScene.model_validate(scene)
+        except ValidationError as e:
+            raise RPCError(INVALID_PARAMS, f"Invalid local scene: {e}") from None
+        return CompiledLocalScene(scene)
+
+    def define(self, scene: LocalScene | dict[str, Any]) -> CompiledLocalScene:
+        compiled = self._compile(scene)
+        with self._lock:
+            self._scenes[compiled.scene.name] = compiled
+        return compiled
+
+    def _send(self, step: LocalSceneStep, t0: float, ready: float) -> LocalSceneStepTiming:
+        if step.delay:
+            time.sleep(step.delay)
+        start = time.perf_counter()
+        timing = LocalSceneStepTiming(id=step.id, status="ok", readyMs=(ready - t0) * 1000, startMs=(start - t0) * 1000)
+        try:
+            timing.response = self._client.commands(step.device, step.command, step.commandType, step.parameter)
+            if isinstance(timing.response, dict) and timing.response.get("statusCode") != 100:
+                timing.status = "failed"
+                timing.error = str(timing.response.get("message"))
+        except Exception as e:
+            timing.status = "failed"
+            timing.error = f"{type(e).__name__}: {e}"
+        end = time.perf_counter()
+        timing.endMs = (end - t0) * 1000
+        timing.durationMs = (end - start) * 1000
+        return timing
+
+    def run(self, scene: str | LocalScene | dict[str, Any]) -> LocalSceneResult:
+        if isinstance(scene, str):
+            with self._lock:
+                compiled = self._scenes.get(scene)
+            if compiled is None:
+                raise RPCError(INVALID_PARAMS, f"Unknown local scene: {scene}")
+        else:
+            compiled = self._compile(scene)
+
+        t0 = time.perf_counter()
+        timings: dict[str, LocalSceneStepTiming] = {}
+        resolved = {step_id: 0 for step_id in compiled.steps}
+        failed_deps: set[str] = set()
+        running: dict[Future, str] = {}
+
+        def submit(step_id: str):
+            # 呼び出し元のコンテキスト(ハンドラの期限など)を引き継いでステップを送る
+            future = self._executor.submit(contextvars.copy_context().run,
+                                           self._send, compiled.steps[step_id], t0, time.perf_counter())
+            running[future] = step_id
+
+        def finish(step_id: str, ok: bool):
+            for child in compiled.children[step_id]:
+                resolved[child] += 1
+                if not ok:
+                    failed_deps.add(child)
+                if resolved[child] < len(compiled.steps[child].after):
+                    continue
+                if child in failed_deps:
+                    # 依存しているステップが失敗したら、その後続は送らない
+                    timings[child] = LocalSceneStepTiming(id=child, status="skipped")
+                    finish(child, False)
+                else:
+                    submit(child)
+
+        for step_id in compiled.roots:
+            submit(step_id)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step_id = running.pop(future)
+                timings[step_id] = future.result()
+                finish(step_id, timings[step_id].status == "ok")
+
+        return LocalSceneResult(name=compiled.scene.name, totalMs=(time.perf_counter() - t0) * 1000,
+                                steps=[timings[step.id] for step in compiled.scene.steps])
+
+
+class SwitchBotLocalSceneMixin:
+    """
+    SwitchBotLocalSceneMixin defines and runs local scenes with a LocalSceneEngine.
+    ローカルシーンの定義と実行を提供する
+    """
+    def __init__(self, max_scene_workers: int = 8):
+        self._local_scene_engine = LocalSceneEngine(self, max_scene_workers)
+
+    def define_local_scene(self: SwitchBotClientProtocol | Self, scene: dict[str, Any]) -> list[str]:
+        compiled = self._local_scene_engine.define(scene)
+        return [step.id for step in compiled.scene.steps]
+
+    def run_local_scene(self: SwitchBotClientProtocol | Self, scene: str | dict[str, Any]) -> LocalSceneResult:
+        return self._local_scene_engine.run(scene)
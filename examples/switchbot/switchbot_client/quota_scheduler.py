@@ -0,0 +1,263 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from enum import IntEnum
+from typing import Callable, TypeVar
+
+import httpx
+
+R = TypeVar('R')
+
+logger = logging.getLogger(__name__)
+
+# SwitchBot API の1日あたりの呼び出し上限
+SWITCHBOT_DAILY_LIMIT = 10000
+
+
+class RequestPriority(IntEnum):
+    INTERACTIVE = 0  # commands, execute_scene などユーザー操作に直結するもの
+    BACKGROUND = 1  # ステータスのポーリングなど後回しにできるもの
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """The calling handler's deadline passed before the request was sent. Not a failure of the API."""
+
+
+class QuotaScheduler:
+    """
+    QuotaScheduler tracks the daily request budget and orders upstream calls by priority.
+    1日のリクエスト予算を管理し、上流への呼び出しを優先度順に流す。予算が少なくなるとBACKGROUNDの呼び出しを遅延・破棄する
+    """
+    def __init__(self,
+                 daily_limit: int = SWITCHBOT_DAILY_LIMIT,
+                 state_path: str | None = None,
+                 max_concurrency: int = 2,
+                 max_interactive_concurrency: int = 8,
+                 defer_below: float = 0.2,
+                 shed_below: float = 0.05,
+                 max_defer: float = 30.0,
+                 persist_interval: float = 5.0,
+                 clock: Callable[[], float] = time.time):
+        assert 0 <= shed_below <= defer_below <= 1, "Invalid thresholds, should be 0 <= shed_below <= defer_below <= 1"
+        self._daily_limit = daily_limit
+        self._state_path = state_path
+        # BACKGROUND はまとめて max_concurrency 本まで。INTERACTIVE (シーンの並列なステップを含む) は別枠で
+        # max_interactive_concurrency 本まで同時に送る
+        self._max_concurrency = max_concurrency
+        self._max_interactive_concurrency = max_interactive_concurrency
+        self._defer_below = defer_below
+        self._shed_below = shed_below
+        self._max_defer = max_defer
+        self._persist_interval = persist_interval
+        self._clock = clock
+
+        self._cond = threading.Condition()
+        self._waiting: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._in_flight_interactive = 0
+        self._next_background_at = 0.0
+        self._last_persisted = 0.0
+        # ファイルへの書き込みは _cond の外で行い、書き込み同士だけをこのロックで順に並べる
+        self._persist_lock = threading.Lock()
+        self._persist_seq = 0
+        self._persisted_seq = 0
+        # 読み込んだ後にカウンタが変わったか。リクエストを処理しないプロセス (リローダーの親) は書き込まない
+        self._dirty = False
+
+        self._day = self._today()
+        self._used = 0
+        self._used_by_priority = {p.name: 0 for p in RequestPriority}
+        self._deferred = 0
+        self._shed = 0
+        self._load()
+
+    def _today(self) -> str:
+        # SwitchBot のカウンタは UTC の日付で区切る
+        return time.strftime("%Y-%m-%d", time.gmtime(self._clock()))
+
+    def _seconds_until_reset(self) -> float:
+        now = self._clock()
+        return 86400 - now % 86400
+
+    def _roll_day(self):
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._used = 0
+            self._used_by_priority = {p.name: 0 for p in RequestPriority}
+            self._next_background_at = 0.0
+
+    @property
+    def remaining(self) -> int:
+        with self._cond:
+            self._roll_day()
+            return max(self._daily_limit - self._used, 0)
+
+    def run(self, priority: RequestPriority, func: Callable[[], R],
+            time_left: Callable[[], float | None] | None = None) -> R:
+        """
+        Call func() once the budget and the concurrency limit allow it. time_left returns the seconds left
+        before the caller's deadline (None for no deadline); waiting never goes past it.
+        """
+        if priority != RequestPriority.INTERACTIVE:
+            self._defer_background(time_left)
+        self._acquire(priority, time_left)
+        try:
+            return func()
+        finally:
+            self._release(priority)
+
+    def _defer_background(self, time_left: Callable[[], float | None] | None = None):
+        # 残り予算が defer_below を下回ったら、リセットまでに予算を使い切らないペースに間引く
+        with self._cond:
+            self._roll_day()
+            remaining = self._daily_limit - self._used
+            if remaining > self._daily_limit * self._defer_below:
+                return
+            allowance = remaining - self._daily_limit * self._shed_below
+            if allowance <= 0:
+                self._shed += 1
+                raise QuotaExceededError(f"Background request shed, {remaining} requests left today")
+            now = self._clock()
+            start_at = max(now, self._next_background_at)
+            wait = start_at - now
+            if wait > self._max_defer:
+                self._shed += 1
+                raise QuotaExceededError(f"Background request shed, next slot in {wait:.1f}s")
+            left = time_left() if time_left is not None else None
+            if left is not None and wait > 0 and wait >= left:
+                # 枠が空く前に呼び出し元の期限が来るなら、枠を取らずに諦める
+                raise DeadlineExceeded(f"Deadline exceeded while deferring, next slot in {wait:.1f}s")
+            self._next_background_at = start_at + self._seconds_until_reset() / allowance
+            if wait > 0:
+                self._deferred += 1
+        if wait > 0:
+            time.sleep(wait)
+
+    def _acquire(self, priority: RequestPriority, time_left: Callable[[], float | None] | None = None):
+        self._persist(self._acquire_slot(priority, time_left))
+
+    def _acquire_slot(self, priority: RequestPriority, time_left: Callable[[], float | None] | None):
+        with self._cond:
+            ticket = (int(priority), next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            while self._waiting[0] != ticket or self._at_capacity(priority):
+                left = time_left() if time_left is not None else None
+                if left is not None and left <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise DeadlineExceeded("Deadline exceeded while waiting for the scheduler")
+                self._cond.wait(left)
+            heapq.heappop(self._waiting)
+            # 順番が来た時点で期限を過ぎていたら、予算を数えずに諦める
+            left = time_left() if time_left is not None else None
+            if left is not None and left <= 0:
+                self._cond.notify_all()
+                raise DeadlineExceeded("Deadline exceeded while waiting for the scheduler")
+            self._roll_day()
+            if self._used >= self._daily_limit:
+                self._cond.notify_all()
+                raise QuotaExceededError(f"Daily request limit ({self._daily_limit}) reached")
+            if priority != RequestPriority.INTERACTIVE and self._used >= self._daily_limit * (1 - self._shed_below):
+                self._shed += 1
+                self._cond.notify_all()
+                raise QuotaExceededError("Background request shed, remaining budget is reserved for commands")
+            self._in_flight += 1
+            if priority == RequestPriority.INTERACTIVE:
+                self._in_flight_interactive += 1
+            self._used += 1
+            self._used_by_priority[priority.name] += 1
+            self._dirty = True
+            return self._persist_state()
+
+    def _at_capacity(self, priority: RequestPriority) -> bool:
+        if priority == RequestPriority.INTERACTIVE:
+            return self._in_flight_interactive >= self._max_interactive_concurrency
+        return self._in_flight - self._in_flight_interactive >= self._max_concurrency
+
+    def _release(self, priority: RequestPriority):
+        with self._cond:
+            self._in_flight -= 1
+            if priority == RequestPriority.INTERACTIVE:
+                self._in_flight_interactive -= 1
+            self._cond.notify_all()
+
+    def mark_exhausted(self):
+        # API側で上限に達したと言われた場合は、ローカルのカウンタもそれに合わせる
+        with self._cond:
+            self._used = max(self._used, self._daily_limit)
+            self._dirty = True
+            state = self._persist_state(force=True)
+        self._persist(state)
+
+    def _load(self):
+        if not self._state_path or not os.path.exists(self._state_path):
+            return
+        try:
+            with open(self._state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("day") == self._day:
+            self._used = int(state.get("used", 0))
+            self._used_by_priority.update(state.get("usedByPriority", {}))
+
+    def _persist_state(self, force: bool = False) -> tuple[int, dict] | None:
+        # _cond を持ったまま呼ぶ。書き込む内容だけを取り出し、書き込みは _persist() で行う
+        if not self._state_path or not self._dirty:
+            return None
+        now = self._clock()
+        if not force and now - self._last_persisted < self._persist_interval:
+            return None
+        self._last_persisted = now
+        self._dirty = False
+        self._persist_seq += 1
+        return self._persist_seq, {"day": self._day, "used": self._used, "usedByPriority": dict(self._used_by_priority)}
+
+    def _persist(self, state: tuple[int, dict] | None):
+        if state is None:
+            return
+        seq, data = state
+        with self._persist_lock:
+            # 後から取り出した内容がもう書かれていれば、古い内容で上書きしない
+            if seq <= self._persisted_seq:
+                return
+            tmp_path = f"{self._state_path}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self._state_path)
+            except OSError:
+                logger.exception("Failed to persist the quota state")
+                return
+            self._persisted_seq = seq
+
+    def flush(self):
+        with self._cond:
+            state = self._persist_state(force=True)
+        self._persist(state)
+
+    def stats(self) -> dict[str, int | str | dict[str, int]]:
+        with self._cond:
+            self._roll_day()
+            return {
+                "day": self._day,
+                "dailyLimit": self._daily_limit,
+                "used": self._used,
+                "remaining": max(self._daily_limit - self._used, 0),
+                "usedByPriority": dict(self._used_by_priority),
+                "inFlight": self._in_flight,
+                "waiting": len(self._waiting),
+                "deferred": self._deferred,
+                "shed": self._shed,
+            }
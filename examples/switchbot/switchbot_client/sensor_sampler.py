@@ -0,0 +1,210 @@
+import logging
+import math
+import threading
+import time
+from typing import Any, Callable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 記録する数値の項目。deviceType が分からない場合はすべての項目名を候補にする
+SENSOR_METRICS: dict[str, tuple[str, ...]] = {
+    "MeterPro(CO2)": ("temperature", "humidity", "CO2", "battery"),
+    "Hub 2": ("temperature", "humidity", "lightLevel"),
+}
+_ALL_METRICS = tuple(sorted({name for names in SENSOR_METRICS.values() for name in names}))
+
+# (1バケットの秒数, バケット数)。10秒 x 1時間、1分 x 1日、10分 x 1週間
+DEFAULT_TIERS: tuple[tuple[float, int], ...] = ((10.0, 360), (60.0, 1440), (600.0, 1008))
+
+
+class _Tier:
+    """
+    Fixed-size ring of time buckets holding count/sum/min/max. A slot is reused once its bucket falls out of range.
+    決まった秒数ごとのバケットの輪。古いバケットの場所は上書きして使い回す
+    """
+    def __init__(self, resolution: float, capacity: int):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.bucket = np.full(capacity, -1, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.sum = np.zeros(capacity, dtype=np.float64)
+        self.min = np.full(capacity, np.inf, dtype=np.float64)
+        self.max = np.full(capacity, -np.inf, dtype=np.float64)
+
+    @property
+    def span(self) -> float:
+        return self.resolution * self.capacity
+
+    def add(self, t: float, value: float):
+        bucket = int(t // self.resolution)
+        i = bucket % self.capacity
+        if self.bucket[i] != bucket:
+            self.bucket[i] = bucket
+            self.count[i] = 0
+            self.sum[i] = 0.0
+            self.min[i] = np.inf
+            self.max[i] = -np.inf
+        self.count[i] += 1
+        self.sum[i] += value
+        if value < self.min[i]:
+            self.min[i] = value
+        if value > self.max[i]:
+            self.max[i] = value
+
+    def window(self, now: float, seconds: float) -> tuple[int, float, float, float]:
+        last = int(now // self.resolution)
+        buckets = np.arange(last - math.ceil(seconds / self.resolution) + 1, last + 1)
+        slots = buckets % self.capacity
+        valid = slots[self.bucket[slots] == buckets]
+        count = int(self.count[valid].sum())
+        if count == 0:
+            return 0, math.nan, math.nan, math.nan
+        return count, float(self.sum[valid].sum()), float(self.min[valid].min()), float(self.max[valid].max())
+
+
+class SensorSeries:
+    """
+    One metric of one device: the latest reading, running totals since start and the downsampled tiers.
+    1台のデバイスの1項目。最新値と起動からの集計、粗さの違う複数のバケットの輪を持つ
+    """
+    def __init__(self, tiers: tuple[tuple[float, int], ...] = DEFAULT_TIERS, max_buckets: int = 64):
+        self.tiers = [_Tier(resolution, capacity) for resolution, capacity in tiers]
+        self.max_buckets = max_buckets
+        self.last: float | None = None
+        self.last_time: float | None = None
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, t: float, value: float):
+        self.last = value
+        self.last_time = t
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for tier in self.tiers:
+            tier.add(t, value)
+
+    def _tier_for(self, seconds: float) -> _Tier:
+        # 窓が max_buckets 個以内のバケットに収まる一番細かい段を使う。どの窓でも集計するバケット数は一定以下
+        for tier in self.tiers:
+            if seconds <= tier.span and seconds / tier.resolution <= self.max_buckets:
+                return tier
+        return self.tiers[-1]
+
+    def window(self, seconds: float, now: float) -> dict[str, Any]:
+        tier = self._tier_for(seconds)
+        count, total, low, high = tier.window(now, min(seconds, tier.span))
+        return {
+            "count": count,
+            "mean": total / count if count else None,
+            "min": low if count else None,
+            "max": high if count else None,
+            "last": self.last,
+            "lastTime": self.last_time,
+            "resolution": tier.resolution,
+        }
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "last": self.last,
+            "lastTime": self.last_time,
+        }
+
+
+class SensorSampler:
+    """
+    Keeps sensor readings in ring buffers so windowed queries never call the SwitchBot API.
+    Readings come from ingest() (e.g. a SwitchBotDeviceStateStore listener) and from polling tracked devices.
+    センサーの値をリングバッファに貯め、「直近5分の CO2」のような問い合わせに上流を呼ばずに答える
+    """
+    def __init__(self, poll: Callable[[str], dict[str, Any]] | None = None, interval: float = 60.0,
+                 tiers: tuple[tuple[float, int], ...] = DEFAULT_TIERS, min_spacing: float = 1.0,
+                 clock: Callable[[], float] = time.time):
+        self._poll = poll
+        self._interval = interval
+        self._tiers = tiers
+        self._min_spacing = min_spacing
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._series: dict[tuple[str, str], SensorSeries] = {}
+        self._tracked: list[str] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.samples = 0
+        self.poll_errors = 0
+
+    def track(self, device_id: str):
+        if device_id not in self._tracked:
+            self._tracked.append(device_id)
+
+    def ingest(self, device_id: str, body: dict[str, Any], t: float | None = None):
+        t = self._clock() if t is None else t
+        names = SENSOR_METRICS.get(body.get("deviceType"), _ALL_METRICS)
+        with self._lock:
+            for name in names:
+                value = body.get(name)
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                key = (device_id, name)
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = SensorSeries(self._tiers)
+                elif series.last_time is not None and t - series.last_time < self._min_spacing:
+                    # ポーリングと Webhook で同じ読み取りが2回届いた場合は1回分として扱う
+                    continue
+                series.add(t, float(value))
+                self.samples += 1
+
+    def poll_once(self):
+        for device_id in list(self._tracked):
+            try:
+                status = self._poll(device_id)
+            except Exception:
+                self.poll_errors += 1
+                logger.exception("Failed to poll %s", device_id)
+                continue
+            if status.get("statusCode") == 100 and isinstance(status.get("body"), dict):
+                self.ingest(device_id, status["body"])
+
+    def start(self):
+        assert self._poll is not None, "SensorSampler needs a poll function to poll devices"
+        self._thread = threading.Thread(target=self._poll_loop, name="switchbot-sensor-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _poll_loop(self):
+        while True:
+            self.poll_once()
+            if self._stop.wait(self._interval):
+                return
+
+    def window(self, device_id: str, metric: str, seconds: float = 300.0) -> dict[str, Any] | None:
+        # count/mean/min/max は直近 seconds 秒 (使う段のバケット単位に丸める)、last は最新の値
+        with self._lock:
+            series = self._series.get((device_id, metric))
+            if series is None:
+                return None
+            return series.window(seconds, self._clock())
+
+    def summary(self, device_id: str) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            return {name: series.summary() for (dev, name), series in self._series.items() if dev == device_id}
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"samples": self.samples, "series": len(self._series), "pollErrors": self.poll_errors,
+                    "trackedDevices": len(self._tracked)}
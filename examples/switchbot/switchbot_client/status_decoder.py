@@ -0,0 +1,37 @@
+from functools import cache
+from typing import Any, Iterable, Type
+
+from pydantic import BaseModel, create_model
+
+from metagadget.rpc import INVALID_PARAMS, RPCError
+from switchbot_client.switchbot_models import SBDeviceStatusResponse
+
+
+@cache
+def status_response_model[T: BaseModel](body_cls: Type[T]) -> Type[SBDeviceStatusResponse[T]]:
+    # SBDeviceStatusResponse[XxxStatusBody] のパラメータ化は呼び出しのたびに行うと重いので、ステータスの型ごとに1回だけ行う
+    return SBDeviceStatusResponse[body_cls]
+
+
+@cache
+def partial_body_model(body_cls: Type[BaseModel], fields: frozenset[str]) -> Type[BaseModel]:
+    # 指定した項目だけを持つモデル。それ以外の項目は検証も変換もしない
+    unknown = fields - body_cls.model_fields.keys()
+    if unknown:
+        raise RPCError(INVALID_PARAMS, f"Unknown fields for {body_cls.__name__}: {', '.join(sorted(unknown))}")
+    definitions = {name: (info.annotation, info) for name, info in body_cls.model_fields.items() if name in fields}
+    return create_model(f"Partial{body_cls.__name__}", **definitions)
+
+
+def decode_status[T: BaseModel](raw: bytes | str | dict[str, Any], body_cls: Type[T],
+                                fields: Iterable[str] | None = None) -> SBDeviceStatusResponse[T]:
+    """
+    Validate a device status response straight from the raw response bytes.
+    レスポンスのバイト列から直接検証する。fields を指定すると body はその項目だけをデコードする
+    """
+    if fields is not None:
+        body_cls = partial_body_model(body_cls, frozenset(fields))
+    model = status_response_model(body_cls)
+    if isinstance(raw, dict):
+        return model.model_validate(raw)
+    return model.model_validate_json(raw)
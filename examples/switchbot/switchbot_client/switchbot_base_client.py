@@ -1,14 +1,18 @@
 import base64
 import hashlib
 import hmac
+import json
 import time
 import uuid
-from typing import Protocol, Type
+from typing import Callable, Iterable, Protocol, Type
 
 import httpx
+from metagadget.resilience import CircuitBreaker, RetryBudget, retry
 from pydantic import BaseModel
 
-from .switchbot_models import SBListDeviceResponse
+from .quota_scheduler import DeadlineExceeded, QuotaScheduler, RequestPriority
+from .status_decoder import decode_status
+from .switchbot_models import SBListDeviceResponse, SBDeviceStatusResponse
 
 
 class SwitchBotClientProtocol(Protocol):
@@ -18,7 +22,13 @@ class SwitchBotClientProtocol(Protocol):
     def get_device_status(self, device_id: str):
         pass
 
-    def _get_device_status_typed[T: BaseModel](self, device_id: str, cls: Type[T]) -> T:
+    def _get_device_status_raw(self, device_id: str) -> bytes:
+        pass
+
+    def poll_device_status(self, device_id: str):
+        pass
+
+    def _get_device_status_typed[T: BaseModel](self, device_id: str, body_cls: Type[T], fields: Iterable[str] | None = None) -> SBDeviceStatusResponse[T]:
         pass
 
     def commands(self, device_id: str, command: str, command_type: str = "command", parameter: str | int = "default"):
@@ -30,11 +40,30 @@ class SwitchBotClientProtocol(Protocol):
     def list_scenes(self):
         pass
 
+# 同じリクエストを送り直してもよいメソッド。POST (デバイスの操作) は接続できなかった場合だけ送り直す
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD"})
+
+
+def _is_server_error(res: httpx.Response) -> bool:
+    return res.status_code >= 500
+
+
 class SwitchBotBaseClient(SwitchBotClientProtocol):
-    def __init__(self, token: str, secret: str):
+    def __init__(self, token: str, secret: str, scheduler: QuotaScheduler | None = None,
+                 timeout_provider: Callable[[], float | None] | None = None,
+                 breaker: CircuitBreaker | None = None, retry_budget: RetryBudget | None = None, max_attempts: int = 3):
         self._token = token
         self._secret = secret
         self._api_url = "https://api.switch-bot.com/v1.1"
+        self._scheduler = scheduler
+        # 呼び出し元のハンドラの残り時間を返す関数 (metagadget.deadline.remaining など)。None を返したら既定のタイムアウト
+        self._timeout_provider = timeout_provider
+        # 呼び出しごとに接続を作り直さないよう、keep-alive の接続プールを共有する
+        self._http = httpx.Client(limits=httpx.Limits(max_connections=16, max_keepalive_connections=16))
+        # API が落ちているときはタイムアウトまで待たずにすぐ失敗させ、再試行の回数も全体で抑える
+        self._breaker = breaker if breaker is not None else CircuitBreaker("SwitchBot API")
+        self._retry_budget = retry_budget if retry_budget is not None else RetryBudget()
+        self._max_attempts = max_attempts
 
     def _generate_sign(self):
         token = self._token
@@ -60,17 +89,82 @@ class SwitchBotBaseClient(SwitchBotClientProtocol):
             'nonce': str(nonce)
         }
 
+    def _request(self, method: str, path: str, priority: RequestPriority = RequestPriority.BACKGROUND, **kwargs) -> httpx.Response:
+        # 署名のタイムスタンプが古くならないよう、ヘッダはスケジューラの順番が来てから生成する
+        def send() -> httpx.Response:
+            timeout = self._timeout_provider() if self._timeout_provider is not None else None
+            if timeout is not None:
+                if timeout <= 0:
+                    # ハンドラの期限を過ぎているなら、予算を使わずに諦める
+                    raise DeadlineExceeded(f"Deadline exceeded before {method} {path}")
+                kwargs["timeout"] = timeout
+            return self._http.request(method, f'{self._api_url}{path}', headers=self._generate_headers(), **kwargs)
+
+        def recorded_send(outcome: list[bool]) -> httpx.Response:
+            try:
+                res = send()
+            except DeadlineExceeded:
+                raise
+            except httpx.TransportError:
+                outcome.append(True)
+                self._breaker.record_failure()
+                raise
+            outcome.append(True)
+            if _is_server_error(res):
+                self._breaker.record_failure()
+            else:
+                self._breaker.record_success()
+            return res
+
+        def attempt() -> httpx.Response:
+            # 回路はスケジューラに並ぶ前に確かめる。開いている間の呼び出しは枠も1日の予算も使わずに失敗させる
+            probe = self._breaker.before()
+            outcome: list[bool] = []
+            try:
+                if self._scheduler is None:
+                    res = recorded_send(outcome)
+                else:
+                    res = self._scheduler.run(priority, lambda: recorded_send(outcome), self._timeout_provider)
+            finally:
+                # 期限切れや予算切れで成否が分からないまま終わった試しの呼び出しは、半開のまま塞がないよう解放する
+                if probe and not outcome:
+                    self._breaker.release()
+            if res.status_code == 429 and self._scheduler is not None:
+                self._scheduler.mark_exhausted()
+            return res
+
+        idempotent = method in IDEMPOTENT_METHODS
+        return retry(attempt, self._retry_budget, self._max_attempts,
+                     retry_on=httpx.TransportError if idempotent else (httpx.ConnectError, httpx.ConnectTimeout),
+                     retry_result=_is_server_error if idempotent else None,
+                     time_left=self._timeout_provider)
+
     def list_devices(self) -> SBListDeviceResponse:
-        res = httpx.get(f'{self._api_url}/devices', headers=self._generate_headers())
+        res = self._request("GET", '/devices')
         return SBListDeviceResponse.model_validate(res.json())
 
     def get_device_status(self, device_id: str):
-        res = httpx.get(f'{self._api_url}/devices/{device_id}/status', headers=self._generate_headers())
-        return res.json()
+        return json.loads(self._get_device_status_raw(device_id))
 
-    def _get_device_status_typed[T: BaseModel](self, device_id: str, cls: Type[T]) -> T:
-        res = self.get_device_status(device_id)
-        return cls.model_validate(res)
+    def _get_device_status_raw(self, device_id: str) -> bytes:
+        res = self._request("GET", f'/devices/{device_id}/status')
+        self._status_fetched(device_id, res.content)
+        return res.content
+
+    def _status_fetched(self, device_id: str, raw: bytes):
+        # 上流から実際にステータスを読んだときにだけ呼ばれる。Mixin が上書きする
+        pass
+
+    def poll_device_status(self, device_id: str):
+        # キャッシュや Webhook の状態を使わず、必ず上流から読む。センサーのポーリング用
+        return json.loads(self._poll_device_status_raw(device_id))
+
+    def _poll_device_status_raw(self, device_id: str) -> bytes:
+        return SwitchBotBaseClient._get_device_status_raw(self, device_id)
+
+    def _get_device_status_typed[T: BaseModel](self, device_id: str, body_cls: Type[T], fields: Iterable[str] | None = None) -> SBDeviceStatusResponse[T]:
+        # res.json() で辞書にしてから検証するのではなく、レスポンスのバイト列から直接検証する
+        return decode_status(self._get_device_status_raw(device_id), body_cls, fields)
 
     def commands(self, device_id: str, command: str, command_type: str = "command", parameter: str | int = "default"):
         request_body = {
@@ -78,14 +172,31 @@ class SwitchBotBaseClient(SwitchBotClientProtocol):
             "command": command,
             "parameter": parameter
         }
-        res = httpx.post(f'{self._api_url}/devices/{device_id}/commands', headers=self._generate_headers(), json=request_body)
+        res = self._request("POST", f'/devices/{device_id}/commands', RequestPriority.INTERACTIVE, json=request_body)
         return res.json()
 
     def execute_scene(self, scene_id: str):
-        res = httpx.post(f'{self._api_url}/scenes/{scene_id}/execute', headers=self._generate_headers())
+        res = self._request("POST", f'/scenes/{scene_id}/execute', RequestPriority.INTERACTIVE)
         return res.json()
 
     def list_scenes(self):
-        res = httpx.get(f'{self._api_url}/scenes', headers=self._generate_headers())
+        res = self._request("GET", '/scenes')
+        return res.json()
+
+    def setup_webhook(self, url: str):
+        request_body = {
+            "action": "setupWebhook",
+            "url": url,
+            "deviceList": "ALL"
+        }
+        res = self._request("POST", '/webhook/setupWebhook', RequestPriority.INTERACTIVE, json=request_body)
         return res.json()
 
+    def close(self):
+        self._http.close()
+
+    def quota_stats(self):
+        return self._scheduler.stats() if self._scheduler is not None else None
+
+    def breaker_stats(self):
+        return {**self._breaker.stats(), "retryBudget": self._retry_budget.stats()}
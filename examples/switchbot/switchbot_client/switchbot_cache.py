@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+from typing import Any, Callable
+
+
+class _Flight:
+    """
+    同じキーに対する進行中の上流呼び出し。後から来た呼び出し元はこれを待って結果を共有する
+    """
+    def __init__(self, generation: tuple[int, int]):
+        self.generation = generation
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class SwitchBotStatusCache:
+    """
+    TTL-based cache with single-flight loading.
+    TTL付きのキャッシュ。同じキーへの同時読み込みは1回の上流呼び出しにまとめる(single-flight)
+    """
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[float, Any]] = {}
+        self._flights: dict[str, _Flight] = {}
+        # invalidate()されるたびに進める。古い世代の読み込み結果は保存しない
+        self._generations: dict[str, int] = {}
+        # clear()されるたびに進める。まだエントリのないキーの読み込み中にclear()された場合もこちらで捨てる
+        self._clear_generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.upstream_calls = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key: str, loader: Callable[[], Any], ttl_of: Callable[[Any], float]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self._clock():
+                self.hits += 1
+                return entry[1]
+            flight = self._flights.get(key)
+            if flight is None:
+                self.misses += 1
+                flight = self._flights[key] = _Flight(self._generation(key))
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            with self._lock:
+                self.upstream_calls += 1
+            flight.result = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                ttl = ttl_of(flight.result) if flight.error is None else 0
+                if ttl > 0 and flight.generation == self._generation(key):
+                    self._entries[key] = (self._clock() + ttl, flight.result)
+            flight.event.set()
+        return flight.result
+
+    def _generation(self, key: str) -> tuple[int, int]:
+        return self._clear_generation, self._generations.get(key, 0)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self.invalidations += 1
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._clear_generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.shared
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "upstreamCalls": self.upstream_calls,
+                "invalidations": self.invalidations,
+                "hitRate": (self.hits + self.shared) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+# デバイス種別ごとのステータスのTTL(秒)。センサー系は変化が遅いので長め、操作対象のデバイスは短め
+DEFAULT_STATUS_TTL_BY_DEVICE_TYPE: dict[str, float] = {
+    "MeterPro(CO2)": 60.0,
+    "Hub 2": 60.0,
+    "Motion Sensor": 5.0,
+    "Plug Mini (JP)": 30.0,
+    "Bot": 10.0,
+    "Strip Light": 10.0,
+    "Color Bulb": 10.0,
+    "Humidifier": 15.0,
+    "Circulator Fan": 10.0,
+}
+
+
+class SwitchBotCacheMixin:
+    """
+    SwitchBotCacheMixin caches list_devices and device status responses, and invalidates a device's status on commands().
+    list_devices と get_device_status の結果をキャッシュし、commands() を送ったデバイスのステータスを無効化する
+    """
+    def __init__(self,
+                 status_ttl_by_device_type: dict[str, float] | None = None,
+                 default_status_ttl: float = 10.0,
+                 list_devices_ttl: float = 300.0):
+        self._status_ttl_by_device_type = dict(DEFAULT_STATUS_TTL_BY_DEVICE_TYPE)
+        if status_ttl_by_device_type:
+            self._status_ttl_by_device_type.update(status_ttl_by_device_type)
+        self._default_status_ttl = default_status_ttl
+        self._list_devices_ttl = list_devices_ttl
+        self._status_cache = SwitchBotStatusCache()
+        self._list_cache = SwitchBotStatusCache()
+
+    def _status_ttl(self, raw: bytes) -> float:
+        try:
+            res = json.loads(raw)
+            if res["statusCode"] != 100:
+                return 0  # エラー応答はキャッシュしない
+            device_type = res["body"]["deviceType"]
+        except (KeyError, TypeError, ValueError):
+            return 0
+        return self._status_ttl_by_device_type.get(device_type, self._default_status_ttl)
+
+    def _list_devices_ttl_of(self, res) -> float:
+        # エラー応答はキャッシュしない
+        return self._list_devices_ttl if res.statusCode == 100 else 0
+
+    def list_devices(self):
+        return self._list_cache.get_or_load("devices", super().list_devices, self._list_devices_ttl_of)
+
+    def _get_device_status_raw(self, device_id: str) -> bytes:
+        # レスポンスのバイト列をキャッシュする。get_device_status も型付きのステータスもここを通る
+        return self._status_cache.get_or_load(
+            device_id, lambda: super(SwitchBotCacheMixin, self)._get_device_status_raw(device_id), self._status_ttl)
+
+    def _poll_device_status_raw(self, device_id: str) -> bytes:
+        # キャッシュを捨ててから読み直し、読んだ値でキャッシュを新しくする
+        self._status_cache.invalidate(device_id)
+        return SwitchBotCacheMixin._get_device_status_raw(self, device_id)
+
+    def commands(self, device_id: str, command: str, command_type: str = "command", parameter: str | int = "default"):
+        try:
+            return super().commands(device_id, command, command_type, parameter)
+        finally:
+            self._status_cache.invalidate(device_id)
+
+    def invalidate_device_status(self, device_id: str | None = None):
+        if device_id is None:
+            self._status_cache.clear()
+        else:
+            self._status_cache.invalidate(device_id)
+
+    def cache_stats(self) -> dict[str, dict[str, int | float]]:
+        return {
+            "deviceStatus": self._status_cache.stats(),
+            "listDevices": self._list_cache.stats(),
+        }
@@ -1,15 +1,48 @@
+from typing import Callable
+
+from metagadget.resilience import CircuitBreaker, RetryBudget
 from switchbot_client.case_insensitive_invoke_mixin import CaseInsensitiveInvokeMixin
+from switchbot_client.device_registry import SwitchBotDeviceRegistryMixin
+from switchbot_client.device_state_store import SwitchBotDeviceStateStore, SwitchBotStateStoreMixin
+from switchbot_client.local_scene import SwitchBotLocalSceneMixin
+from switchbot_client.quota_scheduler import QuotaScheduler
 from switchbot_client.switchbot_base_client import SwitchBotBaseClient
+from switchbot_client.switchbot_cache import SwitchBotCacheMixin
 from switchbot_client.switchbot_mixin import SwitchBotDeviceOpsMixin
 
 
-class SwitchBotClient(SwitchBotBaseClient, SwitchBotDeviceOpsMixin, CaseInsensitiveInvokeMixin):
-    def __init__(self, token: str, secret: str):
+class SwitchBotClient(SwitchBotDeviceRegistryMixin, SwitchBotStateStoreMixin, SwitchBotCacheMixin, SwitchBotBaseClient,
+                      SwitchBotDeviceOpsMixin, SwitchBotLocalSceneMixin, CaseInsensitiveInvokeMixin):
+    # Cluster から名前で呼び出せるメソッド
+    invocable_methods = (
+        "list_devices", "get_device_status", "commands", "execute_scene", "list_scenes", "setup_webhook",
+        "quota_stats", "cache_stats", "invalidate_device_status", "state_store_stats", "breaker_stats",
+        "define_local_scene", "run_local_scene", "resolve_device", "find_devices", "device_registry_stats",
+        "humidifier_turn_on", "humidifier_set_mode", "humidifier_turn_off",
+        "bulb_turn_on", "bulb_turn_off", "bulb_toggle", "bulb_set_brightness", "bulb_set_color_temperature", "bulb_set_color",
+        "strip_turn_on", "strip_turn_off", "strip_toggle", "strip_set_brightness", "strip_set_color_temperature", "strip_set_color",
+        "plug_turn_on", "plug_turn_off", "plug_toggle",
+        "bot_turn_on", "bot_turn_off", "bot_press",
+        "circulator_fan_turn_on", "circulator_fan_turn_off", "circulator_fan_set_night_light_mode",
+        "circulator_fan_set_wind_mode", "circulator_fan_set_wind_speed",
+        "bot_get_device_status", "meter_pro_co2_get_device_status", "motion_sensor_get_device_status",
+        "plug_mini_get_device_status", "strip_light_get_device_status", "color_bulb_get_device_status",
+        "humidifier_get_device_status", "hub2_get_device_status", "circulator_fan_get_device_status",
+    )
+
+    def __init__(self, token: str, secret: str, status_ttl_by_device_type: dict[str, float] | None = None,
+                 scheduler: QuotaScheduler | None = None, state_store: SwitchBotDeviceStateStore | None = None,
+                 timeout_provider: Callable[[], float | None] | None = None,
+                 breaker: CircuitBreaker | None = None, retry_budget: RetryBudget | None = None,
+                 device_registry_refresh_interval: float = 600.0, max_scene_workers: int = 8):
         # 多重継承した場合、super()は最初に指定したクラスのメソッドを呼び出すのでsuperで1個ずらしで呼び出すと、
-        # SwitchBotBaseClient -> SwitchBotClientMixin -> CaseInsensitiveInvokeMixin の順に__init__()が呼び出される
+        # SwitchBotDeviceRegistryMixin -> SwitchBotStateStoreMixin -> SwitchBotCacheMixin -> SwitchBotBaseClient -> SwitchBotLocalSceneMixin -> CaseInsensitiveInvokeMixin の順に__init__()が呼び出される
         # When multiple inheritance, super() calls the method of the first specified class, so if you call it with a shift of one with super(),
-        # __init__() is called in the order of SwitchBotBaseClient -> SwitchBotClientMixin -> CaseInsensitiveInvokeMixin
-        super(SwitchBotClient, self).__init__(token, secret) # SwitchBotBaseClient.__init__(self, token, secret)
-        super(SwitchBotBaseClient, self).__init__() # SwitchBotClientMixin.__init__(self)
-        super(SwitchBotDeviceOpsMixin, self).__init__() # CaseInsensitiveInvokeMixin.__init__(self)
-
+        # __init__() is called in the order of SwitchBotDeviceRegistryMixin -> SwitchBotStateStoreMixin -> SwitchBotCacheMixin -> SwitchBotBaseClient -> SwitchBotLocalSceneMixin -> CaseInsensitiveInvokeMixin
+        super(SwitchBotClient, self).__init__(device_registry_refresh_interval) # SwitchBotDeviceRegistryMixin.__init__(self, device_registry_refresh_interval)
+        super(SwitchBotDeviceRegistryMixin, self).__init__(state_store) # SwitchBotStateStoreMixin.__init__(self, state_store)
+        super(SwitchBotStateStoreMixin, self).__init__(status_ttl_by_device_type) # SwitchBotCacheMixin.__init__(self, status_ttl_by_device_type)
+        super(SwitchBotCacheMixin, self).__init__(token, secret, scheduler, timeout_provider, breaker, retry_budget) # SwitchBotBaseClient.__init__(self, token, secret, scheduler, timeout_provider, breaker, retry_budget)
+        # SwitchBotClientMixin は __init__() を持たないので飛ばす / SwitchBotClientMixin has no __init__(), so it is skipped
+        super(SwitchBotDeviceOpsMixin, self).__init__(max_scene_workers) # SwitchBotLocalSceneMixin.__init__(self, max_scene_workers)
+        super(SwitchBotLocalSceneMixin, self).__init__() # CaseInsensitiveInvokeMixin.__init__(self)
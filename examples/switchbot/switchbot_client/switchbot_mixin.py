@@ -129,31 +129,32 @@ class SwitchBotDeviceOpsMixin:
         return self.commands(device_id, "setWindSpeed", parameter=speed)
 
     # get device status
+    # fields を指定すると、body はその項目だけをデコードする (例: ["temperature", "CO2"])
 
-    def bot_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str) -> SBDeviceStatusResponse[BotStatusBody]:
-        return self._get_device_status_typed(device_id, SBDeviceStatusResponse[BotStatusBody])
+    def bot_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str, fields: list[str] | None = None) -> SBDeviceStatusResponse[BotStatusBody]:
+        return self._get_device_status_typed(device_id, BotStatusBody, fields)
 
-    def meter_pro_co2_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str) -> SBDeviceStatusResponse[MeterProCO2StatusBody]:
-        return self._get_device_status_typed(device_id, SBDeviceStatusResponse[MeterProCO2StatusBody])
+    def meter_pro_co2_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str, fields: list[str] | None = None) -> SBDeviceStatusResponse[MeterProCO2StatusBody]:
+        return self._get_device_status_typed(device_id, MeterProCO2StatusBody, fields)
 
-    def motion_sensor_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str) -> SBDeviceStatusResponse[MotionSensorStatusBody]:
-        return self._get_device_status_typed(device_id, SBDeviceStatusResponse[MotionSensorStatusBody])
+    def motion_sensor_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str, fields: list[str] | None = None) -> SBDeviceStatusResponse[MotionSensorStatusBody]:
+        return self._get_device_status_typed(device_id, MotionSensorStatusBody, fields)
 
-    def plug_mini_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str) -> SBDeviceStatusResponse[PlugMiniJPStatusBody]:
-        return self._get_device_status_typed(device_id, SBDeviceStatusResponse[PlugMiniJPStatusBody])
+    def plug_mini_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str, fields: list[str] | None = None) -> SBDeviceStatusResponse[PlugMiniJPStatusBody]:
+        return self._get_device_status_typed(device_id, PlugMiniJPStatusBody, fields)
 
-    def strip_light_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str) -> SBDeviceStatusResponse[StripLightStatusBody]:
-        return self._get_device_status_typed(device_id, SBDeviceStatusResponse[StripLightStatusBody])
+    def strip_light_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str, fields: list[str] | None = None) -> SBDeviceStatusResponse[StripLightStatusBody]:
+        return self._get_device_status_typed(device_id, StripLightStatusBody, fields)
 
-    def color_bulb_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str) -> SBDeviceStatusResponse[ColorBulbStatusBody]:
-        return self._get_device_status_typed(device_id, SBDeviceStatusResponse[ColorBulbStatusBody])
+    def color_bulb_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str, fields: list[str] | None = None) -> SBDeviceStatusResponse[ColorBulbStatusBody]:
+        return self._get_device_status_typed(device_id, ColorBulbStatusBody, fields)
 
-    def humidifier_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str) -> SBDeviceStatusResponse[HumidifierStatusBody]:
-        return self._get_device_status_typed(device_id, SBDeviceStatusResponse[HumidifierStatusBody])
+    def humidifier_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str, fields: list[str] | None = None) -> SBDeviceStatusResponse[HumidifierStatusBody]:
+        return self._get_device_status_typed(device_id, HumidifierStatusBody, fields)
 
-    def hub2_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str) -> SBDeviceStatusResponse[Hub2StatusBody]:
-        return self._get_device_status_typed(device_id, SBDeviceStatusResponse[Hub2StatusBody])
+    def hub2_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str, fields: list[str] | None = None) -> SBDeviceStatusResponse[Hub2StatusBody]:
+        return self._get_device_status_typed(device_id, Hub2StatusBody, fields)
 
-    def circulator_fan_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str) -> SBDeviceStatusResponse[CirculatorFanStatusBody]:
-        return self._get_device_status_typed(device_id, SBDeviceStatusResponse[CirculatorFanStatusBody])
+    def circulator_fan_get_device_status(self: SwitchBotClientProtocol | Self, device_id: str, fields: list[str] | None = None) -> SBDeviceStatusResponse[CirculatorFanStatusBody]:
+        return self._get_device_status_typed(device_id, CirculatorFanStatusBody, fields)
 
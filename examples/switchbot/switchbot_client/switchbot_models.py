@@ -1,6 +1,6 @@
 from typing import TypeVar
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 T = TypeVar('T', bound=BaseModel)
 
@@ -125,3 +125,17 @@ class CirculatorFanStatusBody(BaseModel):
     oscillation: str  # Horizontal oscillation state
     verticalOscillation: str  # Vertical oscillation state
     fanSpeed: int  # Fan speed, range from 1 to 100
+
+
+class SBWebhookContext(BaseModel):
+    model_config = ConfigDict(extra="allow")  # デバイス種別ごとに異なるステータス項目はそのまま保持する
+
+    deviceType: str  # Device type in webhook notation, e.g., WoHand, WoPresence
+    deviceMac: str  # Device MAC address, e.g., 01:00:5e:90:10:00
+    timeOfSample: int  # Timestamp of the event in milliseconds
+
+
+class SBWebhookEvent(BaseModel):
+    eventType: str  # Event type, e.g., changeReport
+    eventVersion: str  # Event version, e.g., 1
+    context: SBWebhookContext  # Device state reported by the event
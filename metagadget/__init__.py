@@ -1,2 +1,7 @@
+from . import hardware
+from .clock import ClockSync
 from .metagadget import MetaGadget
-__all__ = ["MetaGadget"]
\ No newline at end of file
+from .router import Router
+from .rpc import RPC, RPCError, RawJSON
+from .snapshot import StateSnapshot
+__all__ = ["ClockSync", "MetaGadget", "RPC", "RPCError", "RawJSON", "Router", "StateSnapshot"]
\ No newline at end of file
@@ -0,0 +1,151 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MGCKPT1\n"
+# マジック, スロットの大きさ。この後にスロットが2つ続く
+_HEADER = struct.Struct("<8sI")
+# 書き込みの通し番号, 中身の長さ, CRC32 (通し番号と中身)。この後に中身の JSON が続く
+_SLOT = struct.Struct("<QII")
+
+
+class Checkpoint:
+    """
+    The last applied command per routing key, in a small memory-mapped file, so that a restarted gadget
+    can put its actuators back before it serves the next request.
+
+    update() only replaces the in-memory entry; a background thread writes the latest state. The file has
+    two slots and each write goes to the older one with a higher sequence number and a CRC, so a crash
+    in the middle of a write leaves the previous snapshot readable.
+    """
+
+    def __init__(self, path, slot_size=4096):
+        self.path = path
+        self.slot_size = slot_size
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._closed = False
+        self._mmap = self._open()
+        self._seq, self._state = self._load()
+        self._pending = 0
+        self._thread = threading.Thread(target=self._write_loop, name="metagadget-checkpoint", daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        size = _HEADER.size + 2 * self.slot_size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing = os.fstat(fd).st_size
+            if existing != size:
+                os.ftruncate(fd, size)
+            m = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        header = _HEADER.pack(MAGIC, self.slot_size)
+        if m[:_HEADER.size] != header:
+            if existing:
+                logger.warning("Checkpoint file has a different layout, starting empty", extra={"path": self.path})
+            m[:] = bytes(size)
+            m[:_HEADER.size] = header
+            m.flush()
+        return m
+
+    def _read_slot(self, index):
+        offset = _HEADER.size + index * self.slot_size
+        seq, length, crc = _SLOT.unpack_from(self._mmap, offset)
+        if seq == 0 or length > self.slot_size - _SLOT.size:
+            return 0, None
+        payload = self._mmap[offset + _SLOT.size:offset + _SLOT.size + length]
+        # 書き込みの途中で落ちたスロットは CRC が合わないので使わない
+        if zlib.crc32(payload, zlib.crc32(struct.pack("<Q", seq))) != crc:
+            return 0, None
+        return seq, payload
+
+    def _load(self):
+        seq, payload = max((self._read_slot(0), self._read_slot(1)), key=lambda slot: slot[0])
+        if payload is None:
+            return 0, {}
+        state = json.loads(payload)
+        return seq, {key: json.dumps(command) for key, command in state.items()}
+
+    def state(self):
+        """The saved commands by routing key, as they were passed to update()."""
+        with self._lock:
+            return {key: json.loads(command) for key, command in self._state.items()}
+
+    def update(self, key, command):
+        # JSON にできないコマンドはここで弾く。書き込みスレッドはまとめて書くだけ
+        try:
+            encoded = json.dumps(command)
+        except (TypeError, ValueError):
+            self.errors += 1
+            logger.warning("Command cannot be checkpointed", extra={"key": key})
+            return
+        with self._lock:
+            if self._state.get(key) == encoded:
+                return
+            self._state[key] = encoded
+            self._pending += 1
+        self._dirty.set()
+
+    def _snapshot(self):
+        with self._lock:
+            # 書き込みが追いつかない間に来た更新は、最後の状態だけを書く
+            self.coalesced += max(self._pending - 1, 0)
+            self._pending = 0
+            return ("{" + ",".join(json.dumps(key) + ":" + command for key, command in self._state.items()) + "}").encode()
+
+    def _write(self, payload):
+        if len(payload) > self.slot_size - _SLOT.size:
+            self.errors += 1
+            logger.error("Checkpoint does not fit in the slot", extra={"bytes": len(payload), "slotSize": self.slot_size})
+            return
+        seq = self._seq + 1
+        offset = _HEADER.size + (seq % 2) * self.slot_size
+        crc = zlib.crc32(payload, zlib.crc32(struct.pack("<Q", seq)))
+        # 古い方のスロットに中身を書いてから見出しを書く。もう一方のスロットは最後に書けた状態のまま残る
+        self._mmap[offset + _SLOT.size:offset + _SLOT.size + len(payload)] = payload
+        _SLOT.pack_into(self._mmap, offset, seq, len(payload), crc)
+        self._mmap.flush()
+        self._seq = seq
+        self.writes += 1
+
+    def _write_loop(self):
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+            if self._closed:
+                return
+            try:
+                self.flush()
+            except (OSError, ValueError):
+                self.errors += 1
+                logger.exception("Failed to write the checkpoint")
+
+    def flush(self):
+        """Write the current state now, on the calling thread."""
+        with self._write_lock:
+            if self._pending:
+                self._write(self._snapshot())
+
+    def close(self):
+        self._closed = True
+        self._dirty.set()
+        self._thread.join()
+        self.flush()
+        self._mmap.close()
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self._state), "writes": self.writes, "coalesced": self.coalesced,
+                    "errors": self.errors, "sequence": self._seq}
@@ -0,0 +1,131 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ClockSync:
+    """
+    Estimates the offset between a client's clock and this one from the timestamps sent with requests,
+    and fires actions at a time given on the client's clock.
+
+    A one-way timestamp cannot tell clock offset from network latency, so the offset is taken as the
+    smallest delay seen in the last `window` requests minus `min_latency` (the best-case tunnel latency,
+    0 if unknown). Gadgets that use the same Cluster event and the same min_latency fire together
+    regardless of how late each request arrived.
+    """
+
+    def __init__(self, window=64, alpha=0.1, min_latency=0.0, unit=0.001, spin=0.002, clock=time.time):
+        self.window = window
+        self.alpha = alpha
+        self.min_latency = min_latency
+        self.unit = unit  # クライアントの時刻の単位 (秒)。JavaScript の Date.now() はミリ秒
+        self.spin = spin  # 予定時刻のこの秒数前からは sleep せずに待つ
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._delays = deque(maxlen=window)
+        self._min_delay = None
+        self._mean_delay = None
+        self._jitter = 0.0
+        self.samples = 0
+
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._errors = deque(maxlen=512)
+        self.fired = 0
+        self.late = 0
+        self._thread = None
+
+    def observe(self, client_time, received=None):
+        """Feed the client timestamp of one request. Returns the delay it saw, in seconds."""
+        received = self._clock() if received is None else received
+        delay = received - client_time * self.unit
+        with self._lock:
+            self.samples += 1
+            if len(self._delays) == self._delays.maxlen and self._delays[0] == self._min_delay:
+                self._delays.append(delay)
+                self._min_delay = min(self._delays)
+            else:
+                self._delays.append(delay)
+                if self._min_delay is None or delay < self._min_delay:
+                    self._min_delay = delay
+            if self._mean_delay is None:
+                self._mean_delay = delay
+            else:
+                # 平均からのずれの指数移動平均 (RFC 3550 の jitter と同じ考え方)
+                self._jitter += self.alpha * (abs(delay - self._mean_delay) - self._jitter)
+                self._mean_delay += self.alpha * (delay - self._mean_delay)
+        return delay
+
+    @property
+    def offset(self):
+        """Local clock minus client clock in seconds, or None before the first observation."""
+        with self._lock:
+            return None if self._min_delay is None else self._min_delay - self.min_latency
+
+    def to_local(self, client_time):
+        offset = self.offset
+        assert offset is not None, "No timestamps observed yet"
+        return client_time * self.unit + offset
+
+    def schedule_at(self, local_time, func, *args):
+        """Run func(*args) on the timer thread at local_time (this host's time.time())."""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._timer_loop, name="metagadget-clock", daemon=True)
+                self._thread.start()
+            heapq.heappush(self._queue, (local_time, next(self._seq), func, args))
+            self._cond.notify()
+
+    def schedule(self, client_time, delay, func, *args):
+        """Run func(*args) `delay` seconds after client_time on the client's clock. Returns the local target time."""
+        target = self.to_local(client_time) + delay
+        self.schedule_at(target, func, *args)
+        return target
+
+    def _timer_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                target = self._queue[0][0]
+                wait = target - self._clock() - self.spin
+                if wait > 0:
+                    # 先に近い予定が入るかもしれないので、起きたら先頭から見直す
+                    self._cond.wait(wait)
+                    continue
+                _, _, func, args = heapq.heappop(self._queue)
+            # 最後の数ミリ秒はスリープの誤差を避けるために時刻を見ながら待つ
+            while self._clock() < target:
+                pass
+            error = self._clock() - target
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("Scheduled action failed")
+            with self._lock:
+                self.fired += 1
+                self._errors.append(error)
+                if error > self.spin:
+                    self.late += 1
+
+    def stats(self):
+        with self._lock:
+            errors = sorted(abs(e) for e in self._errors)
+            return {
+                "samples": self.samples,
+                "offsetMs": None if self._min_delay is None else (self._min_delay - self.min_latency) * 1000,
+                "minDelayMs": None if self._min_delay is None else self._min_delay * 1000,
+                "meanDelayMs": None if self._mean_delay is None else self._mean_delay * 1000,
+                "jitterMs": self._jitter * 1000,
+                "fired": self.fired,
+                "late": self.late,
+                "fireErrorP50Ms": errors[len(errors) // 2] * 1000 if errors else None,
+                "fireErrorP99Ms": errors[min(int(len(errors) * 0.99), len(errors) - 1)] * 1000 if errors else None,
+                "fireErrorMaxMs": errors[-1] * 1000 if errors else None,
+            }
@@ -0,0 +1,17 @@
+import contextvars
+import time
+
+_deadline = contextvars.ContextVar("metagadget_deadline", default=None)
+
+
+def remaining(default=None):
+    """Seconds left before the current request's deadline, or default outside a handler with a timeout."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def run_with_deadline(deadline, func, *args):
+    _deadline.set(deadline)
+    return func(*args)
@@ -0,0 +1,238 @@
+"""
+Hardware access for gadgets: the real RPi.GPIO and pygame.mixer, or a simulation that records every
+operation with a timestamp and takes about as long as the real call.
+
+Select the simulation with METAGADGET_HARDWARE=sim or hardware.use("sim") before the first gpio()/mixer().
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+REAL = "real"
+SIM = "sim"
+
+# 1回の呼び出しにかかる秒数の目安 (Raspberry Pi 4 + RPi.GPIO / pygame で測った値に近いもの)
+DEFAULT_TIMING = {
+    "setmode": 2e-6,
+    "setup": 60e-6,
+    "output": 4e-6,
+    "input": 4e-6,
+    "pwm_create": 40e-6,
+    "pwm_start": 120e-6,
+    "pwm_change": 15e-6,
+    "pwm_stop": 80e-6,
+    "cleanup": 300e-6,
+    "mixer_init": 50e-3,
+    "music_load": 8e-3,
+    "music_volume": 10e-6,
+    "music_play": 1.5e-3,
+    "music_stop": 0.5e-3,
+}
+
+Operation = namedtuple("Operation", ["time", "name", "args"])
+
+_backend = os.environ.get("METAGADGET_HARDWARE", REAL)
+_sim = None
+_lock = threading.Lock()
+
+
+class TimingModel:
+    """Per-call costs in seconds. scale=0 turns the delays off; METAGADGET_SIM_TIMING overrides entries as JSON."""
+
+    def __init__(self, costs=None, scale=1.0):
+        self.costs = dict(DEFAULT_TIMING)
+        override = os.environ.get("METAGADGET_SIM_TIMING")
+        if override:
+            self.costs.update(json.loads(override))
+        if costs:
+            self.costs.update(costs)
+        self.scale = float(os.environ.get("METAGADGET_SIM_TIMING_SCALE", scale))
+
+    def spend(self, name):
+        cost = self.costs.get(name, 0.0) * self.scale
+        if cost <= 0:
+            return
+        end = time.perf_counter() + cost
+        # time.sleep は 1ms 未満を正確に待てないので、短いものは時刻を見ながら待つ
+        if cost > 2e-3:
+            time.sleep(cost - 1e-3)
+        while time.perf_counter() < end:
+            pass
+
+
+class SimHardware:
+    """Operation log shared by the simulated GPIO and mixer."""
+
+    def __init__(self, timing=None, max_operations=1000000):
+        self.timing = timing or TimingModel()
+        self.max_operations = max_operations
+        self._lock = threading.Lock()
+        self._operations = []
+        self.pins = {}
+        self.dropped = 0
+
+    def record(self, name, *args):
+        # かかる時間を再現してから、操作が終わった時刻を記録する
+        self.timing.spend(name)
+        op = Operation(time.perf_counter(), name, args)
+        with self._lock:
+            if len(self._operations) < self.max_operations:
+                self._operations.append(op)
+            else:
+                self.dropped += 1
+        return op
+
+    def operations(self, name=None):
+        with self._lock:
+            ops = list(self._operations)
+        return ops if name is None else [op for op in ops if op.name == name]
+
+    def clear(self):
+        with self._lock:
+            self._operations.clear()
+            self.dropped = 0
+
+
+class SimPWM:
+    def __init__(self, hw, pin, frequency):
+        self._hw = hw
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = 0.0
+        hw.record("pwm_create", pin, frequency)
+
+    def start(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+        self._hw.record("pwm_start", self.pin, duty_cycle)
+
+    def ChangeDutyCycle(self, duty_cycle):
+        assert 0.0 <= duty_cycle <= 100.0, f"dutycycle must have a value from 0.0 to 100.0, got {duty_cycle}"
+        self.duty_cycle = duty_cycle
+        self._hw.record("pwm_change", self.pin, duty_cycle)
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+        self._hw.record("pwm_frequency", self.pin, frequency)
+
+    def stop(self):
+        self._hw.record("pwm_stop", self.pin)
+
+
+class SimGPIO:
+    """The part of the RPi.GPIO module that the examples use."""
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self, hw):
+        self._hw = hw
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        self._hw.record("setmode", mode)
+
+    def setup(self, pin, direction, initial=None):
+        self._hw.pins[pin] = self.LOW if initial is None else initial
+        self._hw.record("setup", pin, direction)
+
+    def output(self, pin, value):
+        self._hw.pins[pin] = 1 if value else 0
+        self._hw.record("output", pin, self._hw.pins[pin])
+
+    def input(self, pin):
+        self._hw.record("input", pin)
+        return self._hw.pins.get(pin, self.LOW)
+
+    def PWM(self, pin, frequency):
+        return SimPWM(self._hw, pin, frequency)
+
+    def cleanup(self):
+        self._hw.pins.clear()
+        self._hw.record("cleanup")
+
+
+class SimMusic:
+    def __init__(self, hw):
+        self._hw = hw
+        self.file = None
+        self.volume = 1.0
+        self.playing = False
+
+    def load(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.file = path
+        self._hw.record("music_load", path)
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self._hw.record("music_volume", volume)
+
+    def play(self, loops=0):
+        self.playing = True
+        self._hw.record("music_play", self.file, loops)
+
+    def stop(self):
+        self.playing = False
+        self._hw.record("music_stop")
+
+    def get_busy(self):
+        return self.playing
+
+
+class SimMixer:
+    """The part of pygame.mixer that the examples use."""
+
+    def __init__(self, hw):
+        self._hw = hw
+        self.music = SimMusic(hw)
+
+    def init(self, *args, **kwargs):
+        self._hw.record("mixer_init")
+
+    def quit(self):
+        self._hw.record("mixer_quit")
+
+
+def use(backend, timing=None):
+    """Choose REAL or SIM. Call before the first gpio()/mixer()."""
+    global _backend, _sim
+    assert backend in (REAL, SIM), f"Unknown hardware backend: {backend}"
+    with _lock:
+        _backend = backend
+        if backend == SIM and timing is not None:
+            _sim = SimHardware(timing)
+
+
+def backend():
+    return _backend
+
+
+def sim():
+    """The simulated hardware and its operation log (created on first use)."""
+    global _sim
+    with _lock:
+        if _sim is None:
+            _sim = SimHardware()
+        return _sim
+
+
+def gpio():
+    if _backend == SIM:
+        return SimGPIO(sim())
+    import RPi.GPIO as GPIO
+    return GPIO
+
+
+def mixer():
+    if _backend == SIM:
+        return SimMixer(sim())
+    import pygame
+    return pygame.mixer
@@ -0,0 +1,130 @@
+import importlib
+import logging
+import os
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SwapGate:
+    """
+    Counts requests inside the handler. swap() stops new requests at the gate, waits for the ones
+    inside to finish (up to drain_timeout) and lets the queued ones through once the swap is done.
+    """
+
+    def __init__(self, drain_timeout=5.0):
+        self.drain_timeout = drain_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._swapping = False
+
+    def __enter__(self):
+        with self._cond:
+            while self._swapping:
+                self._cond.wait()
+            self._active += 1
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._active -= 1
+            if self._active == 0:
+                self._cond.notify_all()
+
+    def swap(self, func):
+        with self._cond:
+            while self._swapping:
+                self._cond.wait()
+            self._swapping = True
+            drained = self._cond.wait_for(lambda: self._active == 0, self.drain_timeout)
+        if not drained:
+            logger.warning("Swapping the handler while %d requests are still running", self._active)
+        try:
+            return func()
+        finally:
+            with self._cond:
+                self._swapping = False
+                self._cond.notify_all()
+
+
+class HotReloader:
+    """
+    Watches the source files of handler modules and reloads them in place when they change.
+
+    Only the listed modules are re-executed; GPIO, audio devices and the ngrok tunnel set up elsewhere
+    stay as they are. Keep hardware setup out of the reloaded modules.
+    """
+
+    def __init__(self, app, modules, interval=0.5, drain_timeout=5.0):
+        self.app = app
+        self.modules = [sys.modules[m] if isinstance(m, str) else m for m in modules]
+        for module in self.modules:
+            assert module.__name__ != "__main__", "Move the handler out of the main script to hot reload it"
+            assert getattr(module, "__file__", None), f"{module.__name__} has no source file to watch"
+        self.interval = interval
+        self.gate = SwapGate(drain_timeout)
+        self.reloads = 0
+        self.failures = 0
+        self._mtimes = {module.__name__: self._mtime(module) for module in self.modules}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _mtime(module):
+        try:
+            return os.stat(module.__file__).st_mtime_ns
+        except OSError:
+            return None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._watch, name="metagadget-hot-reload", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            changed = []
+            for module in self.modules:
+                mtime = self._mtime(module)
+                if mtime is not None and mtime != self._mtimes[module.__name__]:
+                    self._mtimes[module.__name__] = mtime
+                    changed.append(module)
+            if changed:
+                self.reload(changed)
+
+    def reload(self, modules=None):
+        """Reload modules (all watched ones by default) and swap in the new handler. False if it failed."""
+        modules = modules or self.modules
+        app = self.app
+        handler = app._dispatch_request
+
+        def swap():
+            # 読み込みに失敗した場合は古いハンドラのまま動かし続ける
+            for module in modules:
+                try:
+                    importlib.reload(module)
+                except Exception:
+                    logger.exception("Failed to reload %s", module.__name__)
+                    return False
+            # モジュールの中で app.receive し直していなければ、同じ名前の関数に差し替える
+            if app._dispatch_request is handler and handler is not None:
+                for module in modules:
+                    if getattr(handler, "__module__", None) == module.__name__:
+                        new_handler = getattr(module, handler.__name__, None)
+                        if callable(new_handler):
+                            app.receive(new_handler, app._timeout, app._priority)
+                        break
+            return True
+
+        ok = self.gate.swap(swap)
+        if ok:
+            self.reloads += 1
+            logger.info("Reloaded %s", ", ".join(module.__name__ for module in modules))
+        else:
+            self.failures += 1
+        return ok
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+INTERACTIVE = "interactive"
+DEFAULT = "default"
+BULK = "bulk"
+
+# 値が小さいほど優先度が高い。バッチの中に複数の優先度が混ざっている場合は一番高いものを使う
+RANKS = {INTERACTIVE: 0, DEFAULT: 1, BULK: 2}
+DEFAULT_WORKERS = {INTERACTIVE: 2, DEFAULT: 2, BULK: 1}
+
+
+class Lane:
+    """
+    One priority class: its own queue and worker threads, and the time commands waited to start.
+    """
+
+    def __init__(self, name, workers, window=512):
+        self.name = name
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"metagadget-{name}")
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self._queued = 0
+        self.completed = 0
+        self.max_wait = 0.0
+
+    def submit(self, func, *args):
+        with self._lock:
+            self._queued += 1
+        return self._executor.submit(self._run, time.perf_counter(), func, args)
+
+    def _run(self, submitted, func, args):
+        wait = time.perf_counter() - submitted
+        with self._lock:
+            self._queued -= 1
+            self._waits.append(wait)
+            if wait > self.max_wait:
+                self.max_wait = wait
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self.completed += 1
+
+    def cancel(self, future):
+        # まだ始まっていなければ取り消す。始まっていたらスレッドは止められないので結果を捨てる
+        if future.cancel():
+            with self._lock:
+                self._queued -= 1
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            queued = self._queued
+            completed = self.completed
+            max_wait = self.max_wait
+        return {
+            "workers": self.workers,
+            "queued": queued,
+            "completed": completed,
+            "waitP50Ms": _percentile(waits, 0.5) * 1000,
+            "waitP99Ms": _percentile(waits, 0.99) * 1000,
+            "waitMaxMs": max_wait * 1000,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * q), len(values) - 1)]
@@ -0,0 +1,147 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord が最初から持っている属性。これ以外は extra= で渡された構造化フィールドとして出力する
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets a repeated warning (same logger, call site and message template) through once per interval.
+    The next one that passes carries the number suppressed in between. At most max_keys warnings are
+    remembered; the one that passed least recently is forgotten first.
+    """
+
+    def __init__(self, interval=60.0, level=logging.WARNING, max_keys=1024):
+        super().__init__()
+        self.interval = interval
+        self.level = level
+        self.max_keys = max_keys
+        # f-string のメッセージは呼ぶたびに別のキーになるので、覚えておく数に上限を設ける
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.pathname, record.lineno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._seen.get(key, (None, 0))
+            if last is not None and now - last < self.interval:
+                self._seen[key] = (last, suppressed + 1)
+                return False
+            self._seen[key] = (now, 0)
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_keys:
+                self._seen.popitem(last=False)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class _DroppingQueueHandler(QueueHandler):
+    # キューが一杯のときはリクエストを待たせずに捨てる
+    dropped = 0
+
+    def prepare(self, record):
+        # メッセージと例外は文字列にしておく。extra= のフィールドは JSONFormatter がそのまま出力する
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure(level=logging.INFO, stream=None, structured=True, max_pending=10000, rate_limit=60.0):
+    """
+    Route the root logger through a bounded queue to a background thread that writes to stream.
+    Logging calls on request threads then never wait for a slow console or journald. Safe to call twice.
+    """
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return _listener
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(JSONFormatter() if structured else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        handler = _DroppingQueueHandler(queue.Queue(max_pending))
+        if rate_limit:
+            handler.addFilter(RateLimitFilter(rate_limit))
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(level)
+        _listener = QueueListener(handler.queue, target, respect_handler_level=True)
+        _listener.start()
+        _handler = handler
+        atexit.register(shutdown)
+        return _listener
+
+
+def shutdown():
+    """Write out what is still queued and stop the background thread."""
+    global _listener, _handler
+    with _lock:
+        if _listener is None:
+            return
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        _listener = None
+        _handler = None
+
+
+def dropped():
+    """Records discarded because the queue was full."""
+    return _handler.dropped if _handler is not None else 0
+
+
+def _restart_in_child():
+    # fork した子プロセスには書き出し用のスレッドが引き継がれないので、同じキューに対して作り直す
+    global _listener
+    if _listener is not None:
+        _listener = QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_in_child)
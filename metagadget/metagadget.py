@@ -1,49 +1,399 @@
 from werkzeug.wrappers import Response, Request
 from werkzeug.serving import run_simple
 import ngrok
+import contextvars
 import json
+import logging
 import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from . import log
+from .checkpoint import Checkpoint
+from .deadline import run_with_deadline
+from .hot_reload import HotReloader
+from .lanes import DEFAULT, DEFAULT_WORKERS, Lane
+from .profiler import SamplingProfiler
+from .recorder import EventRecorder
+from .serving import KeepAliveRequestHandler, admin_allowed
+from .workers import serve_workers
 
 PORT = int(os.environ.get("PORT", 5001))
+# ルーターの後ろで LAN 内のノードとして動かす場合は 0.0.0.0 にする
+HOST = os.environ.get("METAGADGET_HOST", "127.0.0.1")
 DOMAIN = os.environ.get("NGROK_DOMAIN")
 VERIFY = os.environ.get("VERIFY_TOKEN")
+WORKERS = int(os.environ.get("METAGADGET_WORKERS", 0))
+
+logger = logging.getLogger(__name__)
+
+_CONTENT_TYPE_JSON = ("Content-Type", "application/json")
+# ルーターからのヘルスチェックとメトリクスの収集に使う
+HEALTH_PATH = "/_metagadget/health"
+METRICS_PATH = "/_metagadget/metrics"
+_ADMIN_PATHS = frozenset({HEALTH_PATH, METRICS_PATH})
+_BAD_REQUEST = b'{"error": "Request body should be JSON with a \\"request\\" field"}'
+_FORBIDDEN = b'{"error": "Forbidden"}'
 
 
 class MetaGadget:
     def __init__(self):
         self._dispatch_request = None
+        self._parse = None
+        self._webhooks = {}
+        self._recorder = None
+        self._checkpoint = None
+        self._checkpoint_key = None
+        self._middlewares = []
+        self._start_hooks = []
+        self._end_hooks = []
+        self._profiler = None
+        self._timeout = None
+        self._priority = None
+        self._lanes = {}
+        self._stats_lock = threading.Lock()
+        self.stats = {"timeouts": 0}
+        self._reloader = None
+        self._inner_call = None
+        self._serial_lock = None
+        self._call = None
+        self._envelope_head = '{"verify": ' + json.dumps(VERIFY) + ', "response": '
+        self._fast_path = type(self).dispatch_request is MetaGadget.dispatch_request
+
+    def _compile(self):
+        # ミドルウェアとフックを1本の呼び出しにまとめておく。何も登録されていなければハンドラそのものになる
+        call = self._dispatch_request
+        if call is None:
+            self._call = None
+            return
+        if self._checkpoint is not None:
+            # ハンドラが例外なく終わったコマンドだけを、最後に適用した状態として残す
+            call = _with_checkpoint(self._checkpoint, self._checkpoint_key, call)
+        middlewares = list(self._middlewares)
+        if self._profiler is not None:
+            middlewares.insert(0, self._profiler.middleware)
+        for middleware in reversed(middlewares):
+            call = _chain(middleware, call)
+        if self._start_hooks or self._end_hooks:
+            call = _with_hooks(tuple(self._start_hooks), tuple(self._end_hooks), call)
+        if self._timeout is not None or self._priority is not None:
+            call = self._with_lanes(call)
+        elif self._serial_lock is not None:
+            call = _serialized(self._serial_lock, call)
+        if self._reloader is not None:
+            # 差し替え中に届いたリクエストはゲートで待たせ、差し替え後のハンドラで処理する
+            self._inner_call = call
+            call = self._gated_call
+        self._call = call
+
+    def _gated_call(self, command):
+        with self._reloader.gate:
+            return self._inner_call(command)
+
+    def _get_lane(self, name):
+        lane = self._lanes.get(name)
+        if lane is None:
+            lane = self._lanes[name] = Lane(name, DEFAULT_WORKERS.get(name, 1))
+        return lane
+
+    def _with_lanes(self, call_next):
+        timeout = self._timeout
+        priority = self._priority
+        # 優先度ごとに別のキューとワーカーで実行する。bulk のハンドラが詰まっていても interactive は待たされない
+        if callable(priority):
+            lanes = {}
+
+            def lane_of(command):
+                name = priority(command) or DEFAULT
+                lane = lanes.get(name)
+                if lane is None:
+                    lane = lanes[name] = self._get_lane(name)
+                return lane
+        else:
+            fixed = self._get_lane(priority or DEFAULT)
+            lane_of = lambda command: fixed
+        # タイムアウトした場合に Cluster に返すレスポンス
+        timeout_response = json.dumps({"error": {"code": "timeout", "message": f"Handler did not finish in {timeout}s"}})
+
+        def call(command):
+            lane = lane_of(command)
+            if timeout is None:
+                return lane.submit(call_next, command).result()
+            # キューで待っている時間も含めて timeout 秒以内に応答する
+            deadline = time.monotonic() + timeout
+            future = lane.submit(contextvars.copy_context().run, run_with_deadline, deadline, call_next, command)
+            try:
+                return future.result(timeout)
+            except FutureTimeoutError:
+                lane.cancel(future)
+                with self._stats_lock:
+                    self.stats["timeouts"] += 1
+                return timeout_response
+        return call
+
+    def _execute(self, command):
+        # ハードウェアを操作するハンドラの呼び出し。マルチプロセスモードではハードウェアを持つプロセスに転送される
+        return self._call(command)
+
+    def _execute_webhook(self, path, data):
+        return self._webhooks[path](data)
+
+    def _respond(self, request_str):
+        # エンベロープの JSON 文字列を返す。辞書を作らず、先頭部分は起動時に作ったものを使う
+        command = request_str if self._parse is None else self._parse(request_str)
+        if self._recorder is None:
+            _res = self._execute(command)
+        else:
+            started = time.time()
+            t = time.perf_counter()
+            try:
+                _res = self._execute(command)
+            except Exception as e:
+                # 失敗したリクエストも、例外の型を付けて残す
+                self._recorder.record_error(request_str, e, started, time.perf_counter() - t)
+                raise
+            self._recorder.record(request_str, _res, started, time.perf_counter() - t)
+        return self._envelope_head + json.dumps(_res) + "}"
 
     def dispatch_request(self, request):
         assert self._dispatch_request, "No handler registered"
 
         data = request.get_json()
-        _res = self._dispatch_request(data['request'])
+        return Response(self._respond(data['request']), content_type='application/json')
+
+    def _fast_dispatch(self, environ, start_response):
+        # werkzeug の Request と Response を作らずに wsgi.input を読み、bytes を直接返す
+        assert self._dispatch_request, "No handler registered"
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            data = json.loads(environ["wsgi.input"].read(length) if length > 0 else b"")
+            request_str = data['request']
+        except (ValueError, TypeError, KeyError):
+            start_response("400 BAD REQUEST", [_CONTENT_TYPE_JSON, ("Content-Length", str(len(_BAD_REQUEST)))])
+            return [_BAD_REQUEST]
+        body = self._respond(request_str).encode()
+        start_response("200 OK", [_CONTENT_TYPE_JSON, ("Content-Length", str(len(body)))])
+        return [body]
+
+    def dispatch_webhook(self, path, request):
+        # Webhook はサービス側から直接届くので、callExternal の verify エンベロープは付けない
+        data = request.get_json(silent=True)
+        if data is None:
+            return Response(json.dumps({"error": "Webhook body should be JSON"}), status=400, content_type='application/json')
+        try:
+            _res = self._execute_webhook(path, data)
+        except ValueError as e:
+            # ハンドラがペイロードの形式の違いを ValueError (pydantic の ValidationError を含む) で知らせた
+            logger.warning("Rejected a webhook payload", extra={"path": path, "error": str(e)[:500]})
+            return Response(json.dumps({"error": str(e)[:500]}), status=400, content_type='application/json')
+        return Response(json.dumps(_res if _res is not None else {}), content_type='application/json')
 
-        res = {
-            "verify": VERIFY,
-            "response": _res
-        }
-        if not VERIFY:
-            print("The response will not be received by the client. Please set the VERIFY_TOKEN environment variable.")
-        return Response(json.dumps(res), content_type='application/json')
+    def metrics(self):
+        metrics = {"stats": dict(self.stats), "lanes": self.lane_stats()}
+        if self._recorder is not None:
+            metrics["recorder"] = {"recorded": self._recorder.recorded, "dropped": self._recorder.dropped}
+        if self._checkpoint is not None:
+            metrics["checkpoint"] = self._checkpoint.stats()
+        return metrics
+
+    def _dispatch_admin(self, path, environ, start_response):
+        if not admin_allowed(environ):
+            start_response("403 FORBIDDEN", [_CONTENT_TYPE_JSON, ("Content-Length", str(len(_FORBIDDEN)))])
+            return [_FORBIDDEN]
+        body = json.dumps({"ok": True} if path == HEALTH_PATH else self.metrics()).encode()
+        start_response("200 OK", [_CONTENT_TYPE_JSON, ("Content-Length", str(len(body)))])
+        return [body]
 
     def wsgi_app(self, environ, start_response):
-        request = Request(environ)
-        response = self.dispatch_request(request)
+        if environ.get("PATH_INFO") in _ADMIN_PATHS:
+            return self._dispatch_admin(environ["PATH_INFO"], environ, start_response)
+        if self._webhooks:
+            path = "/" + environ.get("PATH_INFO", "").lstrip("/")
+            if path in self._webhooks:
+                request = Request(environ)
+                return self.dispatch_webhook(path, request)(environ, start_response)
+        # dispatch_request() を上書きしたサブクラスや JSON 以外のリクエストは werkzeug を通す
+        if self._fast_path and environ.get("CONTENT_TYPE", "").startswith("application/json"):
+            return self._fast_dispatch(environ, start_response)
+        response = self.dispatch_request(Request(environ))
         return response(environ, start_response)
 
-    def receive(self, func):
+    def receive(self, func=None, timeout=None, priority=None):
+        # @app.receive でも @app.receive(timeout=0.5) でも使える。timeout 秒を過ぎるとタイムアウトのレスポンスを返す
+        # priority は "interactive" / "default" / "bulk" などのレーン名か、コマンドからレーン名を返す関数
+        if func is None:
+            return lambda f: self.receive(f, timeout, priority)
         self._dispatch_request = func
+        self._timeout = timeout
+        self._priority = priority
+        self._compile()
+        return func
+
+    def lane(self, name, workers):
+        # レーンのワーカー数を決める。receive() より前に呼ぶ
+        old = self._lanes.get(name)
+        self._lanes[name] = Lane(name, workers)
+        if old is not None:
+            old.shutdown()
+        self._compile()
+
+    def lane_stats(self):
+        # レーンごとのキュー待ち時間と処理件数
+        return {name: lane.stats() for name, lane in self._lanes.items()}
+
+    def use(self, middleware):
+        # middleware(command, call_next) -> response。登録した順に外側から呼ばれる
+        self._middlewares.append(middleware)
+        self._compile()
+        return middleware
+
+    def on_request_start(self, func):
+        # func(command)
+        self._start_hooks.append(func)
+        self._compile()
+        return func
+
+    def on_request_end(self, func):
+        # func(command, response)。ハンドラが例外を投げた場合 response は None
+        self._end_hooks.append(func)
+        self._compile()
+        return func
+
+    def enable_profiler(self, interval=0.005):
+        if self._profiler is None:
+            self._profiler = SamplingProfiler(interval)
+            self._profiler.start()
+            self._compile()
+        return self._profiler
+
+    def disable_profiler(self, top=20):
+        profiler = self._profiler
+        if profiler is None:
+            return []
+        self._profiler = None
+        self._compile()
+        profiler.stop()
+        return profiler.report(top)
+
+    def hot_reload(self, *modules, interval=0.5, drain_timeout=5.0):
+        # ハンドラのモジュールだけを読み込み直す。プロセスは再起動しないので GPIO や ngrok はそのまま
+        if not modules:
+            assert self._dispatch_request, "Register a handler before enabling hot reload"
+            modules = (self._dispatch_request.__module__,)
+        if self._reloader is not None:
+            self._reloader.stop()
+        self._reloader = HotReloader(self, modules, interval, drain_timeout)
+        self._compile()
+        self._reloader.start()
+        return self._reloader
+
+    def parser(self, func):
+        # リクエストの文字列をハンドラに渡すコマンドに変換する。マルチプロセスモードでは受信側のプロセスで実行される
+        self._parse = func
         return func
 
+    def record(self, path, **kwargs):
+        # すべてのリクエストとレスポンス、処理時間をバイナリのログに残す。python -m metagadget.replay で再生できる
+        self._recorder = EventRecorder(path, **kwargs)
+        return self._recorder
+
+    def checkpoint(self, path, key=None, slot_size=4096):
+        # 最後に適用したコマンドをファイルに残し、再起動したときはリクエストを受ける前にもう一度適用する
+        # key(command) はコマンドの宛先 (アクチュエーター) ごとのキー。None を返したコマンドは残さない
+        self._checkpoint = Checkpoint(path, slot_size)
+        self._checkpoint_key = key or (lambda command: "default")
+        self._compile()
+        return self._checkpoint
+
+    def restore_checkpoint(self):
+        # run() から呼ばれる。WSGI サーバーを自分で立てる場合はリクエストを受ける前に呼ぶ
+        if self._checkpoint is None or self._dispatch_request is None:
+            return 0
+        restored = 0
+        for key, command in self._checkpoint.state().items():
+            try:
+                self._dispatch_request(command)
+                restored += 1
+            except Exception:
+                logger.exception("Failed to restore the checkpointed command", extra={"key": key})
+        if restored:
+            logger.info("Restored %d checkpointed command(s)", restored)
+        return restored
+
+    def webhook(self, path):
+        def decorator(func):
+            self._webhooks[path] = func
+            return func
+        return decorator
+
     def __call__(self, environ, start_response):
         return self.wsgi_app(environ, start_response)
 
-    def run(self):
+    def run(self, workers=WORKERS, host=HOST, port=PORT, tunnel=True, reloader=True):
+        # ルーターの後ろのノードは tunnel=False で動かし、ngrok はルーターだけが使う
+        # ログはキュー経由でバックグラウンドのスレッドが書き出す。アプリ側で設定済みならそちらを使う
+        if not logging.getLogger().handlers:
+            log.configure()
         if not os.environ.get("WERKZEUG_RUN_MAIN"):
-            print("Starting ngrok")
-            ngrok.forward(PORT, authtoken_from_env=True, domain=DOMAIN)
-        run_simple('127.0.0.1', PORT, self, use_debugger=True, use_reloader=True)
+            if not VERIFY:
+                logger.warning("The response will not be received by the client. Please set the VERIFY_TOKEN environment variable.")
+            if tunnel:
+                logger.info("Starting ngrok")
+                ngrok.forward(port, authtoken_from_env=True, domain=DOMAIN)
+        # ホットリロードを使う場合はプロセスごと再起動するリローダーは使わない
+        use_reloader = reloader and self._reloader is None and not workers
+        if not use_reloader or os.environ.get("WERKZEUG_RUN_MAIN"):
+            # リローダーの親プロセスはリクエストを処理しないので、ハードウェアは子プロセスで戻す
+            self.restore_checkpoint()
+        if workers:
+            # HTTP と JSON の処理は workers 個のプロセスで行い、ハンドラはこのプロセスだけで実行する
+            serve_workers(self, host, port, workers)
+            return
+        # keep-alive の接続は待っている間もスレッドを使うので、接続ごとにスレッドで受ける。
+        # レーンを使わない場合、ハンドラはこれまでどおり1つずつ実行する
+        if self._timeout is None and self._priority is None and self._serial_lock is None:
+            self._serial_lock = threading.Lock()
+            self._compile()
+        run_simple(host, port, self, use_debugger=True, use_reloader=use_reloader, threaded=True,
+                   request_handler=KeepAliveRequestHandler)
+
+
+def _chain(middleware, call_next):
+    def call(command):
+        return middleware(command, call_next)
+    return call
+
+
+def _serialized(lock, call_next):
+    def call(command):
+        with lock:
+            return call_next(command)
+    return call
+
+
+def _with_checkpoint(checkpoint, key, call_next):
+    def call(command):
+        response = call_next(command)
+        k = key(command)
+        if k is not None:
+            checkpoint.update(k, command)
+        return response
+    return call
+
+
+def _with_hooks(start_hooks, end_hooks, call_next):
+    def call(command):
+        for hook in start_hooks:
+            hook(command)
+        response = None
+        try:
+            response = call_next(command)
+            return response
+        finally:
+            for hook in end_hooks:
+                hook(command, response)
+    return call
 
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+import sys
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of threads that are inside a handler and counts the functions seen.
+
+    Installed as the outermost middleware by MetaGadget.enable_profiler(), so it costs nothing while off.
+    """
+
+    def __init__(self, interval=0.005, max_depth=32):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._self_counts = Counter()
+        self._total_counts = Counter()
+        self._active = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def middleware(self, command, call_next):
+        ident = threading.get_ident()
+        self._active[ident] = True
+        try:
+            return call_next(command)
+        finally:
+            self._active.pop(ident, None)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop, name="metagadget-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sample_loop(self):
+        stop_code = self.middleware.__code__
+        while not self._stop.wait(self.interval):
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for ident in list(self._active):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                self.samples += 1
+                seen = set()
+                leaf = True
+                depth = 0
+                # middleware() のフレームまで遡る。それより外側はサーバーの処理なので数えない
+                while frame is not None and frame.f_code is not stop_code and depth < self.max_depth:
+                    code = frame.f_code
+                    key = (code.co_filename, code.co_firstlineno, code.co_name)
+                    if leaf:
+                        self._self_counts[key] += 1
+                        leaf = False
+                    if key not in seen:
+                        self._total_counts[key] += 1
+                        seen.add(key)
+                    frame = frame.f_back
+                    depth += 1
+
+    def report(self, top=20):
+        """The hottest functions as dicts, ordered by inclusive sample count."""
+        return [
+            {
+                "function": f"{name} ({filename}:{lineno})",
+                "self": self._self_counts[key],
+                "total": total,
+                "ratio": total / self.samples if self.samples else 0.0,
+            }
+            for key, total in self._total_counts.most_common(top)
+            for filename, lineno, name in (key,)
+        ]
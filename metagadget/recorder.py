@@ -0,0 +1,135 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from collections import namedtuple
+
+MAGIC = b"MGLOG1\n"
+# レコードの長さ(このフィールドを除く), 受信時刻, 処理時間(ms), リクエストの長さ。この後にリクエストとレスポンスが続く
+_HEADER = struct.Struct("<IdfI")
+_STOP = object()
+# ハンドラが例外で終わったリクエストのレスポンスに入れる印
+ERROR_KEY = "__metagadget_error__"
+
+Event = namedtuple("Event", ["time", "duration_ms", "request", "response"])
+
+
+class EventRecorder:
+    """
+    Appends every request, response and handler time to a length-prefixed binary log.
+
+    record() only enqueues; a background thread encodes, writes through a buffered file and rotates the
+    log by size (path, path.1, ... path.N).
+    """
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, backup_count=3, flush_interval=0.5, max_pending=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(max_pending)
+        self._file = self._open()
+        self._thread = threading.Thread(target=self._write_loop, name="metagadget-recorder", daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        f = open(self.path, "ab", buffering=64 * 1024)
+        if f.tell() == 0:
+            f.write(MAGIC)
+            # バッファに残したまま fork すると、子プロセスが閉じるときに同じ内容をもう一度書いてしまう
+            f.flush()
+        return f
+
+    def record(self, request, response, started, duration):
+        try:
+            self._queue.put_nowait((started, duration, request, response))
+        except queue.Full:
+            # 書き込みが追いつかないときは、リクエストの処理を待たせずに捨てる
+            self.dropped += 1
+
+    def record_error(self, request, error, started, duration):
+        """Record a request whose handler raised, with the exception type in place of the response."""
+        # workers モードでは、ハードウェアを持つプロセスで起きた例外の型を使う
+        error_type = getattr(error, "error_type", type(error).__name__)
+        self.record(request, {ERROR_KEY: error_type, "message": str(error)[:500]}, started, duration)
+
+    def _encode(self, started, duration, request, response):
+        req = request.encode() if isinstance(request, str) else json.dumps(request).encode()
+        res = json.dumps(response, default=str).encode()
+        return _HEADER.pack(_HEADER.size - 4 + len(req) + len(res), started, duration * 1000, len(req)) + req + res
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = self._open()
+
+    def _write_loop(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            while item is not None:
+                if item is _STOP:
+                    self._file.close()
+                    return
+                self._file.write(self._encode(*item))
+                self.recorded += 1
+                if self._file.tell() >= self.max_bytes:
+                    self._rotate()
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = time.monotonic()
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+
+def read_log(path):
+    """Yield the Events of one log file in recorded order."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a MetaGadget event log")
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return  # 最後のレコードが書きかけの場合は読み飛ばす
+            length, started, duration_ms, req_len = _HEADER.unpack(header)
+            body = f.read(length - (_HEADER.size - 4))
+            if len(body) < length - (_HEADER.size - 4):
+                return
+            yield Event(started, duration_ms, body[:req_len].decode(), json.loads(body[req_len:]))
+
+
+def is_error(response):
+    return isinstance(response, dict) and ERROR_KEY in response
+
+
+def log_files(path):
+    """The current log and its rotated backups, oldest first."""
+    files = []
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        files.append(f"{path}.{i}")
+        i += 1
+    files.reverse()
+    if os.path.exists(path):
+        files.append(path)
+    return files
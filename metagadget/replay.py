@@ -0,0 +1,112 @@
+import argparse
+import importlib
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from .recorder import is_error, log_files, read_log
+
+
+def _wsgi_sender(app):
+    from werkzeug.test import Client
+    client = Client(app)
+
+    def send(request):
+        return client.post("/", json={"request": request}).get_json()["response"]
+    return send
+
+
+def _http_sender(url):
+    def send(request):
+        body = json.dumps({"request": request}).encode()
+        req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req) as res:
+            return json.loads(res.read())["response"]
+    return send
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def replay(paths, target, fast=False, speed=1.0, concurrency=1):
+    """
+    Send recorded requests to target (a WSGI app or a URL) and compare the responses with the recorded ones.
+
+    By default requests are sent at the recorded pace (divided by speed); with fast=True they are sent as
+    fast as possible over `concurrency` threads, which makes the tool a load generator.
+    """
+    send = _http_sender(target) if isinstance(target, str) else _wsgi_sender(target)
+    lock = threading.Lock()
+    latencies = []
+    stats = {"sent": 0, "mismatched": 0, "errors": 0}
+
+    def play(event):
+        t = time.perf_counter()
+        try:
+            response = send(event.request)
+        except Exception:
+            with lock:
+                # 記録されたときも失敗していたリクエストは、同じく失敗すれば一致とみなす
+                stats["sent" if is_error(event.response) else "errors"] += 1
+            return
+        elapsed = (time.perf_counter() - t) * 1000
+        with lock:
+            stats["sent"] += 1
+            latencies.append(elapsed)
+            if response != event.response or is_error(event.response):
+                stats["mismatched"] += 1
+
+    start = time.perf_counter()
+    first = None
+    with ThreadPoolExecutor(max_workers=concurrency if fast else 1) as executor:
+        for path in paths:
+            for event in read_log(path):
+                if not fast:
+                    # 記録されたときの間隔を再現する
+                    if first is None:
+                        first = event.time
+                    wait = (event.time - first) / speed - (time.perf_counter() - start)
+                    if wait > 0:
+                        time.sleep(wait)
+                executor.submit(play, event)
+    total = time.perf_counter() - start
+
+    stats.update({
+        "seconds": total,
+        "throughput": stats["sent"] / total if total else 0.0,
+        "p50_ms": _percentile(latencies, 0.5),
+        "p99_ms": _percentile(latencies, 0.99),
+        "max_ms": max(latencies, default=0.0),
+    })
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a MetaGadget event log")
+    parser.add_argument("log", help="log path given to app.record(); rotated backups are replayed first")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="send to a running gadget, e.g. http://127.0.0.1:5001/")
+    target.add_argument("--app", help="send to an app in this process, e.g. examples.echo.echo:app")
+    parser.add_argument("--fast", action="store_true", help="ignore the recorded pace")
+    parser.add_argument("--speed", type=float, default=1.0, help="pace multiplier when not --fast")
+    parser.add_argument("--concurrency", type=int, default=1, help="threads used with --fast")
+    args = parser.parse_args()
+
+    if args.url:
+        target = args.url
+    else:
+        module, attr = args.app.split(":")
+        target = getattr(importlib.import_module(module), attr)
+    stats = replay(log_files(args.log), target, args.fast, args.speed, args.concurrency)
+    for key, value in stats.items():
+        print(f"{key:<12} {value:.2f}" if isinstance(value, float) else f"{key:<12} {value}")
+
+
+if __name__ == "__main__":
+    main()
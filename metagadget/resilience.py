@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable (circuit open), retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a downstream service immediately after `failure_threshold` consecutive failures.
+    After `reset_timeout` seconds one probe call is let through; its result closes or re-opens the circuit.
+    """
+
+    def __init__(self, name="downstream", failure_threshold=5, reset_timeout=10.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def before(self):
+        """
+        Raise CircuitOpenError if the call should not be made now. Returns True when the call is the
+        half-open probe; a probe that ends without record_success/record_failure must call release().
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            if self.state == OPEN:
+                waited = self._clock() - self._opened_at
+                if waited >= self.reset_timeout:
+                    self.state = HALF_OPEN
+                    self._probing = True
+                    return True
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.reset_timeout - waited)
+            # HALF_OPEN: 試しの呼び出しの結果が出るまでは他を通さない
+            if not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            raise CircuitOpenError(self.name, 0.0)
+
+    def release(self):
+        # 試しの呼び出しが成否を判断できない形で終わった (送らなかった、期限切れなど)。次の呼び出しを試しに通す
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opens += 1
+                self.state = OPEN
+                self._opened_at = self._clock()
+
+    def call(self, func, *args, **kwargs):
+        self.before()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self):
+        with self._lock:
+            retry_after = max(self.reset_timeout - (self._clock() - self._opened_at), 0.0) if self.state == OPEN else 0.0
+            return {
+                "name": self.name,
+                "state": self.state,
+                "failures": self.failures,
+                "opens": self.opens,
+                "rejected": self.rejected,
+                "retryAfter": retry_after,
+            }
+
+
+class RetryBudget:
+    """
+    Global cap on retries: every call earns `ratio` of a retry token, plus `min_per_second` tokens a second
+    so that quiet periods can still retry. A retry spends one token; with none left the error is returned.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=0.5, max_tokens=10.0, clock=time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = max_tokens
+        self._updated = clock()
+        self.retries = 0
+        self.exhausted = 0
+
+    def _refill(self, amount):
+        now = self._clock()
+        self._tokens = min(self._tokens + amount + (now - self._updated) * self.min_per_second, self.max_tokens)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill(0.0)
+            if self._tokens < 1.0:
+                self.exhausted += 1
+                return False
+            self._tokens -= 1.0
+            self.retries += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            self._refill(0.0)
+            return {"tokens": self._tokens, "retries": self.retries, "exhausted": self.exhausted}
+
+
+def retry(func, budget=None, attempts=3, base_delay=0.1, max_delay=2.0, retry_on=(Exception,), retry_result=None,
+          time_left=None, sleep=time.sleep):
+    """
+    Call func() and retry it with full-jitter exponential backoff while it raises one of retry_on
+    or retry_result(result) is true. Stops early when the budget is spent or the next wait would pass
+    time_left(), returning the last result or raising the last error. CircuitOpenError is never retried.
+    """
+    if budget is not None:
+        budget.deposit()
+    for attempt in range(attempts):
+        error = None
+        try:
+            result = func()
+        except CircuitOpenError:
+            raise
+        except retry_on as e:
+            error = e
+        else:
+            if retry_result is None or not retry_result(result):
+                return result
+        if attempt + 1 == attempts:
+            break
+        delay = random.uniform(0.0, min(max_delay, base_delay * 2 ** attempt))
+        left = time_left() if time_left is not None else None
+        if left is not None and left <= delay:
+            break
+        if budget is not None and not budget.withdraw():
+            break
+        sleep(delay)
+    if error is not None:
+        raise error
+    return result
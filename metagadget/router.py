@@ -0,0 +1,298 @@
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import ngrok
+from werkzeug.serving import run_simple
+
+from . import log
+from .metagadget import DOMAIN, HEALTH_PATH, HOST, METRICS_PATH, PORT
+from .serving import KeepAliveRequestHandler, admin_allowed
+
+logger = logging.getLogger(__name__)
+
+_CONTENT_TYPE_JSON = ("Content-Type", "application/json")
+_ADMIN_PATHS = (HEALTH_PATH, METRICS_PATH)
+_FORBIDDEN = b'{"error": "Forbidden"}'
+# 接続が切れていた keep-alive の接続で送った場合は、同じノードに新しい接続で送り直してよい
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+class NodeUnavailableError(Exception):
+    pass
+
+
+class Node:
+    """
+    One backend gadget on the LAN, with a pool of keep-alive connections and its own request metrics.
+    """
+
+    def __init__(self, address, pool_size=4, timeout=10.0, window=512):
+        self.address = address
+        self.host, port = address.rsplit(":", 1)
+        self.port = int(port)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.healthy = True
+        self.requests = 0
+        self.errors = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+
+    def _new_connection(self, timeout=None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout or self.timeout)
+        try:
+            conn.connect()
+        except OSError as e:
+            # まだ何も送っていないので、別のノードに回してよい
+            raise NodeUnavailableError(f"{self.address}: {e}") from None
+        return conn
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, path, body, headers):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._new_connection()
+        started = time.perf_counter()
+        try:
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                conn.close()
+                conn = self._new_connection()
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            with self._lock:
+                self.errors += 1
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(time.perf_counter() - started)
+        return response.status, response.reason, response.getheader("Content-Type", "application/json"), data
+
+    def get_json(self, path, timeout):
+        conn = self._new_connection(timeout)
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            if response.status != 200:
+                raise NodeUnavailableError(f"{self.address}: {path} returned {response.status}")
+            return json.loads(response.read())
+        finally:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "healthy": self.healthy,
+                "requests": self.requests,
+                "errors": self.errors,
+                "pooledConnections": len(self._idle),
+                "latencyP50Ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+                "latencyP99Ms": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000 if latencies else None,
+            }
+
+
+def path_key(path):
+    # /led-3/switchbot/webhook -> ("led-3", "/switchbot/webhook")。Cluster のアイテムごとに URL のパスで宛先を分ける
+    key, _, rest = path.lstrip("/").partition("/")
+    return key, "/" + rest
+
+
+class Router:
+    """
+    One public ingress in front of many gadget nodes on the LAN.
+
+    routes maps a routing key to node addresses ("host:port"), first preferred. By default the key is
+    the first path segment, so a Cluster item posting to https://<domain>/led-3 reaches the "led-3"
+    nodes at "/". A request goes to the first healthy node. Another node is tried only when the
+    connection could not be made, so a command is never run twice. Connections are pooled and reused;
+    MetaGadget nodes answer over HTTP/1.1 and keep them alive.
+    """
+
+    def __init__(self, routes, key=path_key, pool_size=4, timeout=10.0, health_interval=2.0, health_timeout=1.0):
+        self._key = key
+        self._nodes = {}
+        self.routes = {}
+        for route, addresses in routes.items():
+            if isinstance(addresses, str):
+                addresses = [addresses]
+            nodes = []
+            for address in addresses:
+                node = self._nodes.get(address)
+                if node is None:
+                    node = self._nodes[address] = Node(address, pool_size, timeout)
+                nodes.append(node)
+            self.routes[route] = nodes
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.failovers = 0
+        self.unrouted = 0
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        # {"routes": {"led-3": ["192.168.0.13:5001", "192.168.0.14:5001"], ...}}
+        with open(path) as f:
+            config = json.load(f)
+        return cls(config["routes"], **{**config.get("options", {}), **kwargs})
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def forward(self, key, method, path, body, headers):
+        nodes = self.routes.get(key)
+        if nodes is None:
+            self._count("unrouted")
+            return 404, "NOT FOUND", "application/json", json.dumps({"error": f"No route for '{key}'"}).encode()
+        # 正常なノードを優先し、すべて落ちていると判定されていても最後に一度は試す
+        candidates = [node for node in nodes if node.healthy] + [node for node in nodes if not node.healthy]
+        for i, node in enumerate(candidates):
+            try:
+                return node.request(method, path, body, headers)
+            except NodeUnavailableError as e:
+                node.healthy = False
+                logger.warning("Node unavailable, trying the next one: %s", e, extra={"route": key})
+                if i + 1 < len(candidates):
+                    self._count("failovers")
+            except (OSError, http.client.HTTPException) as e:
+                # 送った後に失敗した場合はノードで実行されたかもしれないので、他のノードには回さない
+                node.healthy = False
+                logger.warning("Node failed during a request: %s", e, extra={"route": key, "node": node.address})
+                return 502, "BAD GATEWAY", "application/json", json.dumps({"error": f"Node {node.address} failed: {e}"}).encode()
+        return 503, "SERVICE UNAVAILABLE", "application/json", json.dumps({"error": f"No node for '{key}' is reachable"}).encode()
+
+    def check_health(self):
+        for node in list(self._nodes.values()):
+            try:
+                node.get_json(HEALTH_PATH, self.health_timeout)
+                healthy = True
+            except (OSError, ValueError, http.client.HTTPException, NodeUnavailableError):
+                healthy = False
+            if healthy != node.healthy:
+                logger.info("Node %s is %s", node.address, "up" if healthy else "down")
+            node.healthy = healthy
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._health_loop, name="metagadget-router-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for node in self._nodes.values():
+            node.close()
+
+    def metrics(self):
+        """Router counters, per-node forwarding stats and each reachable node's own metrics, with totals."""
+        nodes = {}
+        totals = {}
+        for address, node in self._nodes.items():
+            entry = node.stats()
+            if node.healthy:
+                try:
+                    entry["metrics"] = node.get_json(METRICS_PATH, self.health_timeout)
+                    for name, value in entry["metrics"].get("stats", {}).items():
+                        if isinstance(value, (int, float)):
+                            totals[name] = totals.get(name, 0) + value
+                except (OSError, ValueError, http.client.HTTPException, NodeUnavailableError):
+                    pass
+            nodes[address] = entry
+        return {
+            "failovers": self.failovers,
+            "unrouted": self.unrouted,
+            "healthyNodes": sum(node.healthy for node in self._nodes.values()),
+            "nodes": nodes,
+            "totals": {
+                "requests": sum(node.requests for node in self._nodes.values()),
+                "errors": sum(node.errors for node in self._nodes.values()),
+                **totals,
+            },
+        }
+
+    def wsgi_app(self, environ, start_response):
+        path = environ.get("PATH_INFO") or "/"
+        key, node_path = self._key(path)
+        if path in _ADMIN_PATHS or node_path in _ADMIN_PATHS:
+            # ngrok から来たリクエストには、ルーターのものもノードのもの (ルーター経由なら LAN から来たように見える) も見せない
+            if not admin_allowed(environ) or path not in _ADMIN_PATHS:
+                start_response("403 FORBIDDEN", [_CONTENT_TYPE_JSON, ("Content-Length", str(len(_FORBIDDEN)))])
+                return [_FORBIDDEN]
+            body = json.dumps({"ok": True} if path == HEALTH_PATH else self.metrics()).encode()
+            start_response("200 OK", [_CONTENT_TYPE_JSON, ("Content-Length", str(len(body)))])
+            return [body]
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = environ["wsgi.input"].read(length) if length > 0 else b""
+        if environ.get("QUERY_STRING"):
+            node_path += "?" + environ["QUERY_STRING"]
+        headers = {"Content-Type": environ.get("CONTENT_TYPE") or "application/json"}
+        status, reason, content_type, data = self.forward(key, environ["REQUEST_METHOD"], node_path, body, headers)
+        start_response(f"{status} {reason}", [("Content-Type", content_type), ("Content-Length", str(len(data)))])
+        return [data]
+
+    def __call__(self, environ, start_response):
+        return self.wsgi_app(environ, start_response)
+
+    def run(self, host=HOST, port=PORT, tunnel=True):
+        if not logging.getLogger().handlers:
+            log.configure()
+        if tunnel and not os.environ.get("WERKZEUG_RUN_MAIN"):
+            logger.info("Starting ngrok")
+            ngrok.forward(port, authtoken_from_env=True, domain=DOMAIN)
+        self.check_health()
+        self.start()
+        try:
+            run_simple(host, port, self, threaded=True, request_handler=KeepAliveRequestHandler)
+        finally:
+            self.stop()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Forward callExternal requests to gadget nodes on the LAN")
+    parser.add_argument("config", help='JSON file: {"routes": {"<key>": ["host:port", ...]}}')
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--no-tunnel", action="store_true", help="do not start ngrok")
+    args = parser.parse_args()
+    Router.from_file(args.config).run(args.host, args.port, tunnel=not args.no_tunnel)
+
+
+if __name__ == "__main__":
+    main()
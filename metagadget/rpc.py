@@ -0,0 +1,363 @@
+import inspect
+import json
+import typing
+from functools import lru_cache
+
+from .lanes import DEFAULT, RANKS
+from .resilience import CircuitOpenError
+
+try:
+    from types import UnionType
+except ImportError:  # Python < 3.10
+    UnionType = typing.Union
+
+PARSE_ERROR = "parse_error"
+INVALID_REQUEST = "invalid_request"
+METHOD_NOT_FOUND = "method_not_found"
+INVALID_PARAMS = "invalid_params"
+INTERNAL_ERROR = "internal_error"
+UNAVAILABLE = "unavailable"
+
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+    def __reduce__(self):
+        # マルチプロセスモードではパース結果としてプロセス間で受け渡される
+        return RPCError, (self.code, self.message)
+
+    def to_dict(self):
+        return {"error": {"code": self.code, "message": self.message}}
+
+
+@lru_cache(maxsize=1024)
+def normalize_name(name):
+    # botPress でも bot_press でも同じ関数を呼べるようにする
+    return name.lower().replace('_', '')
+
+
+def _type_check(annotation):
+    # アノテーションから JSON の値を検査する関数を作る。検査できない型は None (検査しない)
+    if annotation is inspect.Parameter.empty or annotation is typing.Any or isinstance(annotation, str):
+        return None
+    if annotation is None or annotation is type(None):
+        return lambda v: v is None
+    if annotation is bool:
+        return lambda v: v is True or v is False
+    if annotation is int:
+        return lambda v: isinstance(v, int) and not isinstance(v, bool)
+    if annotation is float:
+        return lambda v: isinstance(v, (int, float)) and not isinstance(v, bool)
+    if annotation is str:
+        return lambda v: isinstance(v, str)
+
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union or origin is UnionType:
+        checks = [_type_check(arg) for arg in typing.get_args(annotation)]
+        if any(check is None for check in checks):
+            return None
+        return lambda v: any(check(v) for check in checks)
+    if origin is typing.Literal:
+        choices = typing.get_args(annotation)
+        return lambda v: v in choices
+    if origin is not None:
+        annotation = origin
+    if annotation in (list, tuple, typing.Sequence):
+        return lambda v: isinstance(v, list)
+    if annotation in (dict, typing.Mapping):
+        return lambda v: isinstance(v, dict)
+    if isinstance(annotation, type):
+        return lambda v: isinstance(v, annotation)
+    return None
+
+
+def _type_name(annotation):
+    if isinstance(annotation, type):
+        return annotation.__name__
+    return str(annotation).replace("typing.", "")
+
+
+class ArgumentValidator:
+    """
+    Checks call arguments against a function signature, compiled once per function.
+    """
+
+    def __init__(self, func):
+        signature = inspect.signature(func)
+        try:
+            hints = typing.get_type_hints(func)
+        except Exception:
+            hints = {}
+
+        self.positional = []
+        self.keywords = {}
+        self.required = set()
+        # 位置で渡せる必須引数の数と、キーワードでしか渡せない必須引数があるか
+        self.required_positional = 0
+        self.required_keyword_only = False
+        self.var_positional = False
+        self.var_keyword = False
+        for param in signature.parameters.values():
+            if param.kind is param.VAR_POSITIONAL:
+                self.var_positional = True
+                continue
+            if param.kind is param.VAR_KEYWORD:
+                self.var_keyword = True
+                continue
+            annotation = hints.get(param.name, param.annotation)
+            entry = (param.name, _type_check(annotation), _type_name(annotation))
+            if param.kind is not param.KEYWORD_ONLY:
+                self.positional.append(entry)
+            if param.kind is not param.POSITIONAL_ONLY:
+                self.keywords[param.name] = entry
+            if param.default is param.empty:
+                self.required.add(param.name)
+                if param.kind is param.KEYWORD_ONLY:
+                    self.required_keyword_only = True
+                else:
+                    self.required_positional += 1
+
+    @staticmethod
+    def _check(entry, value):
+        name, check, type_name = entry
+        if check is not None and not check(value):
+            raise RPCError(INVALID_PARAMS, f"Argument '{name}' should be {type_name}, got {type(value).__name__}")
+
+    def __call__(self, args, kwargs):
+        if len(args) > len(self.positional) and not self.var_positional:
+            raise RPCError(INVALID_PARAMS, f"Takes {len(self.positional)} positional arguments but {len(args)} were given")
+        for entry, value in zip(self.positional, args):
+            self._check(entry, value)
+        for name, value in kwargs.items():
+            entry = self.keywords.get(name)
+            if entry is None:
+                if not self.var_keyword:
+                    raise RPCError(INVALID_PARAMS, f"Unexpected argument '{name}'")
+                continue
+            self._check(entry, value)
+        if len(args) < self.required_positional or kwargs or self.required_keyword_only:
+            given = {entry[0] for entry in self.positional[:len(args)]}
+            for name in kwargs:
+                if name in given:
+                    raise RPCError(INVALID_PARAMS, f"Multiple values for argument '{name}'")
+            given.update(kwargs)
+            missing = self.required - given
+            if missing:
+                raise RPCError(INVALID_PARAMS, f"Missing arguments: {', '.join(sorted(missing))}")
+
+
+class RawJSON(str):
+    """Already encoded JSON. Returned from a registered function, it is embedded in the response as-is."""
+
+
+# 選んだパスが途中の値 (数値や文字列) を通り抜ける場合の印。そのフィールドは結果に含めない
+_MISSING = object()
+
+
+def _freeze(tree):
+    # 末端のフィールドだけの節はキーのタプルにして、要素ごとの再帰呼び出しを省く
+    if all(sub is True for sub in tree.values()):
+        return tuple(tree)
+    return {key: sub if sub is True else _freeze(sub) for key, sub in tree.items()}
+
+
+@lru_cache(maxsize=256)
+def _field_tree(fields):
+    # ("body.deviceList.deviceId", "statusCode") -> {"body": {"deviceList": ("deviceId",)}, "statusCode": True}
+    tree = {}
+    for path in fields:
+        node = tree
+        *parents, leaf = path.split(".")
+        for part in parents:
+            node = node.setdefault(part, {})
+            if node is True:
+                # 親のフィールドがまるごと選ばれている
+                break
+        else:
+            node[leaf] = True
+    return _freeze(tree)
+
+
+def _pick(value, keys):
+    if isinstance(value, dict):
+        return {key: value[key] for key in keys if key in value}
+    model_fields = getattr(type(value), "__pydantic_fields__", None)
+    if model_fields is not None:
+        return {key: getattr(value, key) for key in keys if key in model_fields}
+    return _MISSING
+
+
+def _drop_missing(values):
+    picked = [v for v in values if v is not _MISSING]
+    # どの要素でもパスをたどれなかったリストは、リストごと含めない
+    return _MISSING if values and not picked else picked
+
+
+def _pick_all(values, keys):
+    if values:
+        cls = type(values[0])
+        model_fields = getattr(cls, "__pydantic_fields__", None)
+        if model_fields is not None and all(type(v) is cls for v in values):
+            # 同じモデルが並ぶリスト (deviceList など) は、フィールドの確認を一度で済ませる
+            keys = [key for key in keys if key in model_fields]
+            return [{key: getattr(v, key) for key in keys} for v in values]
+    return _drop_missing([_pick(v, keys) for v in values])
+
+
+def project(value, tree):
+    """
+    Keep only the fields in tree. Lists are projected element by element. Fields that a value does not
+    have, and paths that run through a scalar, are left out; a value with no resolvable path is _MISSING.
+    """
+    if tree is True:
+        return value
+    if isinstance(value, RawJSON):
+        value = json.loads(value)
+    if isinstance(value, (list, tuple)):
+        if isinstance(tree, tuple):
+            return _pick_all(value, tree)
+        return _drop_missing([project(v, tree) for v in value])
+    if isinstance(tree, tuple):
+        return _pick(value, tree)
+    if isinstance(value, dict):
+        picked = {key: project(value[key], sub) for key, sub in tree.items() if key in value}
+    else:
+        model_fields = getattr(type(value), "__pydantic_fields__", None)
+        if model_fields is None:
+            return _MISSING
+        # pydantic のモデルは model_dump せずに、選ばれたフィールドだけを属性から読む
+        picked = {key: project(getattr(value, key), sub) for key, sub in tree.items() if key in model_fields}
+    return {key: v for key, v in picked.items() if v is not _MISSING}
+
+
+def _default(o):
+    # pydantic のモデルなどはそのまま JSON にできないので辞書にする
+    model_dump = getattr(o, "model_dump", None)
+    if model_dump is not None:
+        return model_dump(mode="json")
+    if isinstance(o, (set, frozenset, tuple)):
+        return list(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class RPC:
+    """
+    Explicitly registered remote procedure calls for callExternal requests.
+
+    A request is a JSON object {"functionName": ..., "args": [...], "kwargs": {...}} or a list of them.
+    An optional "fields": ["body.deviceList.deviceId", ...] returns only those dotted paths of the result.
+    Each function has a priority class; pass rpc.priority to MetaGadget.receive(priority=...) to run
+    calls in the matching lane.
+    """
+
+    def __init__(self, max_batch=32):
+        self._methods = {}
+        self._max_batch = max_batch
+
+    def register(self, func=None, name=None, priority=DEFAULT):
+        def decorator(f):
+            key = normalize_name(name or f.__name__)
+            assert key not in self._methods, f"{name or f.__name__} is already registered"
+            self._methods[key] = (f, ArgumentValidator(f), priority)
+            return f
+        if func is None:
+            return decorator
+        return decorator(func)
+
+    def register_object(self, obj, names, priority=DEFAULT):
+        # priority はすべてのメソッドに同じレーン名か、メソッド名からレーン名を返す関数
+        for name in names:
+            self.register(getattr(obj, name), name=name, priority=priority(name) if callable(priority) else priority)
+
+    def _priority_of(self, request):
+        if isinstance(request, dict):
+            name = request.get("functionName")
+            if isinstance(name, str):
+                entry = self._methods.get(normalize_name(name))
+                if entry is not None:
+                    return entry[2]
+        return DEFAULT
+
+    def priority(self, request):
+        # パース済みのリクエストのレーン名。バッチは中で一番優先度の高い関数に合わせる
+        if isinstance(request, list):
+            return min(map(self._priority_of, request), key=lambda p: RANKS.get(p, RANKS[DEFAULT]), default=DEFAULT)
+        return self._priority_of(request)
+
+    def dispatch(self, request):
+        try:
+            if not isinstance(request, dict):
+                raise RPCError(INVALID_REQUEST, "Request should be an object")
+            name = request.get("functionName")
+            if not isinstance(name, str):
+                raise RPCError(INVALID_REQUEST, "functionName should be a string")
+            args = request.get("args") or []
+            kwargs = request.get("kwargs") or {}
+            if not isinstance(args, list) or not isinstance(kwargs, dict):
+                raise RPCError(INVALID_REQUEST, "args should be an array and kwargs an object")
+            fields = request.get("fields")
+            if fields is not None:
+                if not isinstance(fields, list) or not all(isinstance(f, str) and f for f in fields):
+                    raise RPCError(INVALID_REQUEST, "fields should be an array of dotted paths")
+                tree = _field_tree(tuple(fields))
+            try:
+                func, validator, _ = self._methods[normalize_name(name)]
+            except KeyError:
+                raise RPCError(METHOD_NOT_FOUND, f"{name} is not found") from None
+            validator(args, kwargs)
+            try:
+                result = func(*args, **kwargs)
+            except AssertionError as e:
+                # デバイスの操作は引数の範囲チェックに assert を使っている
+                raise RPCError(INVALID_PARAMS, str(e)) from None
+            if fields is None:
+                return {"result": result}
+            # 応答を小さくするためのもので、エンコードはまるごと返すより遅くなることがある
+            result = project(result, tree)
+            return {"result": None if result is _MISSING else result}
+        except RPCError as e:
+            return e.to_dict()
+        except CircuitOpenError as e:
+            # 下流のサービスが落ちているときは待たずに失敗させる。Cluster 側は retryAfter 秒後にやり直せる
+            return {"error": {"code": UNAVAILABLE, "message": str(e), "retryAfter": round(e.retry_after, 1)}}
+        except Exception as e:
+            return {"error": {"code": INTERNAL_ERROR, "type": type(e).__name__, "message": str(e)[:500]}}
+
+    def _encode_one(self, response):
+        result = response.get("result")
+        if isinstance(result, RawJSON):
+            return '{"result":' + result + '}'
+        try:
+            if hasattr(result, "model_dump_json"):
+                # pydantic のモデルは辞書を経由せずに pydantic に JSON を書かせる
+                return '{"result":' + result.model_dump_json() + '}'
+            return json.dumps(response, default=_default, separators=(',', ':'))
+        except (TypeError, ValueError) as e:
+            return json.dumps(RPCError(INTERNAL_ERROR, f"Result is not serializable: {e}").to_dict())
+
+    def encode(self, response):
+        if isinstance(response, list):
+            return '[' + ','.join(map(self._encode_one, response)) + ']'
+        return self._encode_one(response)
+
+    def parse(self, data):
+        # MetaGadget.parser() に渡すと、レーンを選ぶ前に一度だけパースする。失敗した場合は RPCError を返す
+        try:
+            return json.loads(data)
+        except (TypeError, ValueError) as e:
+            return RPCError(PARSE_ERROR, str(e))
+
+    def handle(self, data):
+        return self.handle_parsed(self.parse(data))
+
+    def handle_parsed(self, request):
+        if isinstance(request, RPCError):
+            return self.encode(request.to_dict())
+        if isinstance(request, list):
+            if len(request) > self._max_batch:
+                return self.encode(RPCError(INVALID_REQUEST, f"Batch is limited to {self._max_batch} calls").to_dict())
+            return self.encode([self.dispatch(r) for r in request])
+        return self.encode(self.dispatch(request))
@@ -0,0 +1,96 @@
+import hmac
+import ipaddress
+import os
+import socket
+
+from werkzeug.serving import WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
+
+# ngrok などを通って外から来たリクエストで /_metagadget/ を見るときのトークン (X-MetaGadget-Token ヘッダ)
+# VERIFY_TOKEN は callExternal の応答に入るので使わない
+ADMIN_TOKEN = os.environ.get("METAGADGET_ADMIN_TOKEN")
+
+
+class _Drained:
+    """
+    Stands in for the connection and its input while werkzeug finishes a response. werkzeug reads
+    whatever the client sent after the response and throws it away, which on a kept-alive connection
+    is the next request; this reads as an empty stream that select() reports ready at once.
+    """
+
+    def __init__(self):
+        # 書き込み側を閉じたパイプは、いつでも読み込み可能 (EOF) になる
+        self._fd, write_fd = os.pipe()
+        os.close(write_fd)
+
+    def fileno(self):
+        return self._fd
+
+    def read(self, size=-1):
+        return b""
+
+
+_DRAINED = _Drained()
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    werkzeug's request handler speaking HTTP/1.1, so that a connection stays open between requests
+    (the router keeps a pool of them per node). The server has to be threaded: an idle keep-alive
+    connection holds its thread until `timeout` seconds pass.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = 60
+    # 要求行が不正な場合は run_wsgi() より前に send_error() から send_header() が呼ばれる
+    _input = None
+
+    def setup(self):
+        super().setup()
+        # werkzeug はヘッダと本文を別々に書くので、Nagle のアルゴリズムで本文が遅れないようにする
+        try:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
+    def make_environ(self):
+        environ = super().make_environ()
+        # 本文の長さが分かるリクエストだけ接続を残す。アプリが読まなかった本文は、次のリクエストの前に読み捨てる
+        self._input = None
+        if "wsgi.input_terminated" not in environ and self.headers.get("Connection", "").lower() != "close":
+            self._input = environ["wsgi.input"] = LimitedStream(self.rfile, int(environ.get("CONTENT_LENGTH") or 0))
+            # レスポンスの後で werkzeug が読み捨てるのは、次のリクエストではなく空のストリームにする
+            self._connection, self._rfile = self.connection, self.rfile
+            self.connection = self.rfile = _DRAINED
+        return environ
+
+    def send_header(self, keyword, value):
+        # werkzeug は常に Connection: close を付けて接続を閉じる
+        if keyword == "Connection" and value == "close" and self._input is not None:
+            return
+        super().send_header(keyword, value)
+
+    def run_wsgi(self):
+        self._input = None
+        try:
+            super().run_wsgi()
+        finally:
+            if self._input is not None:
+                self.connection, self.rfile = self._connection, self._rfile
+        if self._input is not None:
+            self._input.exhaust()
+
+
+def admin_allowed(environ):
+    """
+    Whether a request may read the admin paths: sent directly from this host or the LAN, or carrying
+    METAGADGET_ADMIN_TOKEN. Requests through ngrok arrive from localhost but with X-Forwarded-For.
+    """
+    if "HTTP_X_FORWARDED_FOR" not in environ and "HTTP_FORWARDED" not in environ:
+        try:
+            addr = ipaddress.ip_address(environ.get("REMOTE_ADDR") or "")
+        except ValueError:
+            addr = None
+        if addr is not None and (addr.is_loopback or addr.is_private):
+            return True
+    token = environ.get("HTTP_X_METAGADGET_TOKEN")
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from .rpc import RawJSON
+
+
+def _flatten(value, prefix, out):
+    # ネストした辞書を "devices.ABC.power" のようなパスと値の組にする
+    if isinstance(value, dict) and value:
+        for key, child in value.items():
+            _flatten(child, f"{prefix}.{key}" if prefix else str(key), out)
+    else:
+        out[prefix] = value
+    return out
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+class StateSnapshot:
+    """
+    Versioned key-value state that answers polls with only the fields changed since a given version.
+
+    A delta is {"v": version, "d": {path: value}, "r": [removed paths]}; when the client's version is
+    unknown or too old the answer is a full resync {"v": version, "f": {path: value}}.
+
+    Versions are "<epoch>.<n>" strings. The epoch is new for every instance, so a client that kept the
+    version of a previous run (e.g. across a restart of the gadget) gets a full resync.
+    """
+
+    def __init__(self, history=256):
+        self.epoch = os.urandom(4).hex()
+        self._lock = threading.Lock()
+        self._fields = {}
+        self._version = 0
+        # バージョン -> そのバージョンで変わったパス。古いものから捨てる
+        self._changes = OrderedDict()
+        self._history = history
+        self._full_cache = None
+
+    @property
+    def version(self):
+        return self._token(self._version)
+
+    def _token(self, version):
+        return f"{self.epoch}.{version}"
+
+    def _parse(self, since):
+        # 別のインスタンスのバージョンや読めない値は 0 (全体の再同期) として扱う
+        if isinstance(since, str):
+            epoch, _, version = since.partition(".")
+            if epoch != self.epoch or not version.isdigit():
+                return 0
+            return int(version)
+        return 0
+
+    def update(self, key, value):
+        """Replace the state under key, recording only the leaf fields that actually changed."""
+        new_fields = _flatten(value, key, {})
+        with self._lock:
+            prefix = key + "."
+            old_paths = [path for path in self._fields if path == key or path.startswith(prefix)]
+            changed = {path for path in old_paths if path not in new_fields}
+            for path in changed:
+                del self._fields[path]
+            for path, field in new_fields.items():
+                if path not in self._fields or self._fields[path] != field:
+                    self._fields[path] = field
+                    changed.add(path)
+            if changed:
+                self._commit(changed)
+            return self._token(self._version)
+
+    def remove(self, key):
+        with self._lock:
+            prefix = key + "."
+            changed = {path for path in self._fields if path == key or path.startswith(prefix)}
+            for path in changed:
+                del self._fields[path]
+            if changed:
+                self._commit(changed)
+            return self._token(self._version)
+
+    def _commit(self, changed):
+        self._version += 1
+        self._changes[self._version] = changed
+        while len(self._changes) > self._history:
+            self._changes.popitem(last=False)
+        self._full_cache = None
+
+    def delta(self, since=0):
+        since = self._parse(since)
+        with self._lock:
+            token = self._token(self._version)
+            if since == self._version:
+                return {"v": token, "d": {}}
+            oldest = next(iter(self._changes), self._version + 1)
+            if since <= 0 or since > self._version or since < oldest - 1:
+                return {"v": token, "f": dict(self._fields)}
+            paths = set()
+            for version in range(since + 1, self._version + 1):
+                paths |= self._changes[version]
+            changed = {}
+            removed = []
+            for path in paths:
+                if path in self._fields:
+                    changed[path] = self._fields[path]
+                else:
+                    removed.append(path)
+            res = {"v": token, "d": changed}
+            if removed:
+                res["r"] = removed
+            return res
+
+    def encode_delta(self, since=0):
+        """Compact JSON for delta(since). The full resync is encoded once per version."""
+        since = self._parse(since)
+        with self._lock:
+            full_cache = self._full_cache
+            if full_cache is not None and (since <= 0 or since > self._version):
+                return full_cache
+        res = self.delta(self._token(since))
+        encoded = RawJSON(_dumps(res))
+        if "f" in res:
+            with self._lock:
+                if res["v"] == self._token(self._version):
+                    self._full_cache = encoded
+        return encoded
@@ -0,0 +1,194 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import wait
+
+from werkzeug.serving import make_server
+
+from .recorder import EventRecorder
+from .serving import KeepAliveRequestHandler
+
+logger = logging.getLogger(__name__)
+
+REQUEST = 0
+WEBHOOK = 1
+METRICS = 2
+RECORD = 3
+
+# レーンの結果を待ってから返事を送るスレッドの数。これを超えたリクエストは空くまで待つ
+FORWARD_THREADS = 32
+
+
+class OwnerUnavailableError(Exception):
+    pass
+
+
+class HandlerError(Exception):
+    """A handler raised in the hardware-owner process. error_type is the name of the original exception."""
+
+    def __init__(self, error_type, message):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+
+
+class _OwnerClient:
+    """
+    Receiver side of the pipe to the hardware-owner process. Replies are matched to callers by request id.
+    """
+
+    def __init__(self, conn, timeout):
+        self._conn = conn
+        self._timeout = timeout
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = {}
+        threading.Thread(target=self._read_replies, daemon=True).start()
+
+    def _read_replies(self):
+        while True:
+            try:
+                req_id, ok, result = self._conn.recv()
+            except (EOFError, OSError):
+                # ハードウェアを持つプロセスが落ちたら、待っている呼び出しをすべて失敗させる
+                for slot in list(self._pending.values()):
+                    slot[1] = (False, "Hardware owner process exited")
+                    slot[0].set()
+                return
+            slot = self._pending.get(req_id)
+            if slot is not None:
+                slot[1] = (ok, result)
+                slot[0].set()
+
+    def send(self, kind, key, payload):
+        # 返事を待たない通知
+        with self._send_lock:
+            self._conn.send((next(self._ids), kind, key, payload))
+
+    def call(self, kind, key, payload):
+        req_id = next(self._ids)
+        slot = self._pending[req_id] = [threading.Event(), None]
+        try:
+            with self._send_lock:
+                self._conn.send((req_id, kind, key, payload))
+            if not slot[0].wait(self._timeout):
+                raise OwnerUnavailableError(f"No reply from the hardware owner process in {self._timeout}s")
+        finally:
+            del self._pending[req_id]
+        ok, result = slot[1]
+        if not ok:
+            if isinstance(result, ValueError):
+                # Webhook のペイロードの形式の違いは、受信側で 400 にする
+                raise result
+            if isinstance(result, tuple):
+                raise HandlerError(*result)
+            raise OwnerUnavailableError(result)
+        return result
+
+
+class _RecorderProxy:
+    """Receiver side of the event recorder: events go to the recorder of the hardware-owner process."""
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def record(self, request, response, started, duration):
+        self._owner.send(RECORD, None, (request, response, started, duration))
+
+    record_error = EventRecorder.record_error
+
+
+def _receiver_main(app, host, port, fd, conn, timeout):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    owner = _OwnerClient(conn, timeout)
+    # このプロセスではハンドラを実行せず、パース済みのコマンドをハードウェアを持つプロセスに送る
+    app._execute = lambda command: owner.call(REQUEST, None, command)
+    app._execute_webhook = lambda path, data: owner.call(WEBHOOK, path, data)
+    # 記録用のスレッドは fork で引き継がれないので、記録と統計はハードウェアを持つプロセスのものを使う
+    if app._recorder is not None:
+        app._recorder = _RecorderProxy(owner)
+    app.metrics = lambda: owner.call(METRICS, None, None)
+    server = make_server(host, port, app, threaded=True, request_handler=KeepAliveRequestHandler, fd=fd)
+    server.serve_forever()
+
+
+def _handle(app, conn, send_lock, req_id, kind, key, payload):
+    if kind == RECORD:
+        app._recorder.record(*payload)
+        return
+    try:
+        if kind == REQUEST:
+            result = (True, app._call(payload))
+        elif kind == METRICS:
+            result = (True, app.metrics())
+        else:
+            result = (True, app._webhooks[key](payload))
+    except ValueError as e:
+        result = (False, ValueError(str(e)) if kind == WEBHOOK else (type(e).__name__, str(e)))
+    except Exception as e:
+        result = (False, (type(e).__name__, str(e)))
+    with send_lock:
+        conn.send((req_id,) + result)
+
+
+def _owner_loop(app, conns):
+    # レーンを使う場合は、優先度の高いコマンドが前のコマンドを待たないようにスレッドプールで受け渡す (実行はレーンのワーカー)
+    laned = app._timeout is not None or app._priority is not None
+    forward = ThreadPoolExecutor(max_workers=FORWARD_THREADS, thread_name_prefix="metagadget-forward") if laned else None
+    send_locks = {conn: threading.Lock() for conn in conns}
+    try:
+        while conns:
+            for conn in wait(conns):
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    conns.remove(conn)
+                    continue
+                args = (app, conn, send_locks[conn]) + tuple(message)
+                if forward is not None and message[1] == REQUEST:
+                    forward.submit(_handle, *args)
+                else:
+                    _handle(*args)
+    finally:
+        if forward is not None:
+            forward.shutdown(wait=False)
+
+
+def serve_workers(app, host, port, workers, timeout=10.0):
+    """
+    Serve with `workers` receiver processes sharing one listening socket. Receivers parse requests and
+    forward compact commands over a pipe; handlers only ever run in this (hardware-owner) process.
+    """
+    ctx = multiprocessing.get_context("fork")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    conns = []
+    procs = []
+    for _ in range(workers):
+        owner_end, receiver_end = ctx.Pipe()
+        proc = ctx.Process(target=_receiver_main, args=(app, host, port, sock.fileno(), receiver_end, timeout), daemon=True)
+        proc.start()
+        receiver_end.close()
+        conns.append(owner_end)
+        procs.append(proc)
+    logger.info("Running on http://%s:%d with %d receiver processes", host, port, workers,
+                extra={"ownerPid": os.getpid()})
+
+    try:
+        _owner_loop(app, conns)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join()
+        sock.close()